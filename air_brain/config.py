@@ -3,4 +3,8 @@ paths useful across the project
 """
 from pathlib import Path
 
-data_dir = Path(__file__).parent.parent.resolve() / "data"
\ No newline at end of file
+data_dir = Path(__file__).parent.parent.resolve() / "data"
+
+# on disk cache of expensive results, see air_brain.util.cache
+cache_dir = data_dir / "cache"
+cache_max_bytes = 2 * 1024 ** 3
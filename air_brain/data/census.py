@@ -1,13 +1,21 @@
 """
 utilities for downloading files from the US Census
 
-right now this is only Allegheny County 2010 census tract shapefiles, but could also include
-- ACS data (for demographics)
+right now this is
+- Allegheny County 2010 census tract shapefiles
+- ACS 5-year estimates (for demographics) at census tract and block group level
+
+but could also include
 - 2020 census tract shapefiles
 - block group shapefiles
 """
+import os
+import zipfile
+
+import pandas as pd
+
 from air_brain.config import data_dir
-from air_brain.data.util import download_zip
+from air_brain.data.util import download_url, download_zip
 
 base_url_2010 = "https://www2.census.gov/geo/pvs/tiger2010st/42_Pennsylvania/42003/"
 tract_zip_url = "{}tl_2010_42003_tract10.zip".format(base_url_2010)
@@ -16,3 +24,203 @@ def get_2010_tracts():
     save_dir = data_dir / "tract_2010"
     print("Downloading 2010 Census tract data to {}".format(save_dir))
     download_zip(tract_zip_url, save_dir)
+
+
+class ACS5:
+    """
+    American Community Survey 5-year estimates, from the bulk summary files
+
+    the summary file splits every table into "sequences", each downloadable on its own
+    so asking for a column only downloads and parses the sequence it lives in,
+    and only the requested columns of that sequence are kept
+
+    rows are filtered to the requested counties as the sequence file is streamed,
+    and the result is stored as parquet at block group and tract level, with the same ID as AbcEJ
+    columns already stored are not re-parsed when new ones are requested
+
+    this is the sequence based format, used for 2010 - 2019 (i.e. 2010 census geography)
+    """
+    save_dir = os.path.join(data_dir, "acs")
+    base_url = "https://www2.census.gov/programs-surveys/acs/summary_file"
+    state = "Pennsylvania"
+    state_abbr = "pa"
+    state_fips = "42"
+    # summary levels in the geography file
+    levels = {"tract": "140",
+              "bg": "150"}
+    # leading columns of each sequence file, before the table cells
+    seq_columns = ["FILEID", "FILETYPE", "STUSAB", "CHARITER", "SEQUENCE", "LOGRECNO"]
+    # positions of the columns we use in the geography file, which has no header
+    geo_columns = {2: "SUMLEVEL", 3: "COMPONENT", 4: "LOGRECNO",
+                   9: "STATE", 10: "COUNTY", 13: "TRACT", 14: "BLKGRP"}
+    chunk_size = 10000
+
+    def __init__(self, year=2019, counties=("003",)):
+        self.year = year
+        self.counties = tuple(counties)
+
+    @property
+    def state_url(self):
+        """
+        string url of the directory with the tract and block group files for this state
+        """
+        return "{}/{}/data/5_year_seq_by_state/{}/Tracts_Block_Groups_Only".format(
+            self.base_url, self.year, self.state)
+
+    @property
+    def lookup_url(self):
+        """
+        string url of the table -> sequence lookup file
+        """
+        return "{}/{}/documentation/user_tools/ACS_5yr_Seq_Table_Number_Lookup.txt".format(
+            self.base_url, self.year)
+
+    @property
+    def lookup_file(self):
+        return os.path.join(self.save_dir, "{}_seq_lookup.txt".format(self.year))
+
+    @property
+    def geo_filename(self):
+        return "g{}5{}.csv".format(self.year, self.state_abbr)
+
+    @property
+    def geo_file(self):
+        return os.path.join(self.save_dir, self.geo_filename)
+
+    def seq_filename(self, seq):
+        """
+        string base filename of sequence number seq, without extension
+        """
+        return "{}5{}{:04d}000".format(self.year, self.state_abbr, seq)
+
+    def seq_zip_file(self, seq):
+        return os.path.join(self.save_dir, "{}.zip".format(self.seq_filename(seq)))
+
+    def data_file(self, level):
+        """
+        string full path to where the usable file is saved for level (tract or bg)
+        keyed on the counties too, since the file only has their rows
+        """
+        return os.path.join(self.save_dir, "{}_{}_{}.parquet".format(self.year, "-".join(self.counties), level))
+
+    def _download(self, url, save_path):
+        if not os.path.exists(save_path):
+            os.makedirs(self.save_dir, exist_ok=True)
+            print("Downloading {} to {}".format(url, save_path))
+            download_url(url, save_path)
+
+    def lookup(self):
+        """
+        where each table cell lives in the sequence files
+
+        :return:
+        pandas DataFrame with columns
+        - code : str, e.g. B01003_001
+        - seq : int, sequence number
+        - position : int, 0-indexed column in the sequence file
+        """
+        self._download(self.lookup_url, self.lookup_file)
+        df = pd.read_csv(self.lookup_file, dtype=str, encoding="latin-1")
+        df = df.rename(columns={"Table ID": "table", "Sequence Number": "seq",
+                                "Line Number": "line", "Start Position": "start"})
+        # the start position is only given on the row with the title of each table
+        df["start"] = pd.to_numeric(df.start, errors="coerce")
+        df["start"] = df.groupby("table").start.transform("first")
+        df["line"] = pd.to_numeric(df.line, errors="coerce")
+        # skip headers, which have no or fractional line numbers
+        df = df.loc[df.line.notna() & (df.line % 1 == 0)].copy()
+        df["code"] = df.table + "_" + df.line.astype(int).map("{:03d}".format)
+        df["seq"] = df.seq.astype(int)
+        df["position"] = (df.start - 1 + df.line - 1).astype(int)
+        return df[["code", "seq", "position"]]
+
+    def geo(self):
+        """
+        logical record numbers and IDs for the tracts and block groups in self.counties
+
+        :return:
+        pandas DataFrame with columns
+        - LOGRECNO : int
+        - level : str, tract or bg
+        - ID : int, census tract or block group ID (same as AbcEJ)
+        """
+        self._download("{}/{}".format(self.state_url, self.geo_filename), self.geo_file)
+        df = pd.read_csv(self.geo_file, header=None, dtype=str, encoding="latin-1",
+                         usecols=list(self.geo_columns))
+        df = df.rename(columns=self.geo_columns)
+        df = df.loc[(df.COMPONENT == "00") & df.COUNTY.isin(self.counties)]
+        ret = []
+        for level, sumlevel in self.levels.items():
+            sub = df.loc[df.SUMLEVEL == sumlevel].copy()
+            ids = sub.STATE + sub.COUNTY + sub.TRACT
+            if level == "bg":
+                ids = ids + sub.BLKGRP
+            sub["ID"] = ids.astype(int)
+            sub["level"] = level
+            ret.append(sub)
+        ret = pd.concat(ret)
+        ret["LOGRECNO"] = ret.LOGRECNO.astype(int)
+        return ret[["LOGRECNO", "level", "ID"]]
+
+    def read_seq(self, seq, positions, logrecnos):
+        """
+        stream one sequence file, keeping only the given columns and rows
+
+        :param seq: int sequence number
+        :param positions: dict of 0-indexed column position -> column code
+        :param logrecnos: set of int logical record numbers to keep
+        :return: pandas DataFrame with LOGRECNO and one float column per code
+        """
+        self._download("{}/{}.zip".format(self.state_url, self.seq_filename(seq)), self.seq_zip_file(seq))
+        logrecno_col = self.seq_columns.index("LOGRECNO")
+        usecols = [logrecno_col] + sorted(positions)
+        chunks = []
+        with zipfile.ZipFile(self.seq_zip_file(seq)) as zf:
+            with zf.open("e{}.txt".format(self.seq_filename(seq))) as f:
+                for chunk in pd.read_csv(f, header=None, dtype=str, usecols=usecols,
+                                         chunksize=self.chunk_size, encoding="latin-1"):
+                    chunk = chunk.loc[chunk[logrecno_col].astype(int).isin(logrecnos)]
+                    chunks.append(chunk)
+        df = pd.concat(chunks).rename(columns={logrecno_col: "LOGRECNO", **positions})
+        df["LOGRECNO"] = df.LOGRECNO.astype(int)
+        for code in positions.values():
+            # missing estimates are "." in some years
+            df[code] = pd.to_numeric(df[code], errors="coerce").astype("float64")
+        return df
+
+    def get_data(self, columns):
+        """
+        ACS estimates for columns, for each tract and block group in self.counties
+        downloads and parses only the sequences holding columns not already saved
+
+        :param columns: list of column codes (e.g. ["B01003_001"]), or dict of column code -> name
+        :return:
+        dict of level (tract or bg) -> pandas DataFrame with columns ID and one per requested column
+        """
+        names = columns if isinstance(columns, dict) else {code: code for code in columns}
+        saved = {level: pd.read_parquet(self.data_file(level)) if os.path.exists(self.data_file(level)) else None
+                 for level in self.levels}
+        missing = [code for code in names
+                   if any(df is None or code not in df.columns for df in saved.values())]
+
+        if missing:
+            lookup = self.lookup().set_index("code")
+            unknown = [code for code in missing if code not in lookup.index]
+            assert not unknown, "{} not in ACS {} lookup".format(", ".join(unknown), self.year)
+            geo = self.geo()
+            logrecnos = set(geo.LOGRECNO)
+            new = geo
+            for seq, grp in lookup.loc[missing].groupby("seq"):
+                print("Reading ACS {} sequence {}".format(self.year, seq))
+                positions = dict(zip(grp.position, grp.index))
+                new = new.merge(self.read_seq(seq, positions, logrecnos), on="LOGRECNO",
+                                how="left", validate="1:1")
+            for level, df in saved.items():
+                level_new = new.loc[new.level == level].drop(columns=["LOGRECNO", "level"])
+                if df is not None:
+                    df = df.drop(columns=[code for code in missing if code in df.columns])
+                    level_new = df.merge(level_new, on="ID", how="outer", validate="1:1")
+                level_new.to_parquet(self.data_file(level), index=False)
+                saved[level] = level_new
+
+        return {level: df[["ID"] + list(names)].rename(columns=names) for level, df in saved.items()}
@@ -14,6 +14,7 @@ import pandas as pd
 
 from air_brain.config import data_dir
 from air_brain.data.util import download_url
+from air_brain.util.cache import cached
 from air_brain.util.loc import bg2zip
 
 class AbcEJ(metaclass=ABCMeta):
@@ -139,7 +140,8 @@ class AbcEJ(metaclass=ABCMeta):
         df = df.loc[df.ID.astype(str).str.startswith("42003")]
         df.to_csv(self.data_file)
 
-    def avg_by_tract(self):
+    @cached(files=lambda self: [self.data_file])
+    def tract_avg(self):
         """
         EPA EJ data is provided averaged over census block group
         re-average that to the census tract, weighted by area
@@ -167,8 +169,15 @@ class AbcEJ(metaclass=ABCMeta):
         for demo in self.demos:
             avg_df[demo] = avg_df["{}_x_pop".format(demo)] / avg_df.totalpop
             avg_df.loc[avg_df.totalpop == 0, demo] = 0
-        # write out for later
-        avg_df[["ID"] + self.subs + self.demos].to_csv(self.tract_file, index=False)
+        return avg_df[["ID"] + self.subs + self.demos]
+
+    def avg_by_tract(self):
+        """
+        re-average to the census tract (see tract_avg) and write out for later
+        """
+        df = self.tract_avg()
+        df.to_csv(self.tract_file, index=False)
+        return df
 
     def avg_by_zipcode(self):
         """
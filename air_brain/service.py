@@ -0,0 +1,293 @@
+"""
+local query service for exposures, e.g. for a dashboard or quick questions from analysts
+
+loads everything into memory once at startup
+- geography geometry (with its spatial index already built)
+- daily geography estimates from the daily store (see air_brain.util.daily_store)
+- daily measurements and locations of each sensor site (DailyAir)
+- EPA EJ averages for the geography
+and answers
+- /point?lat=...&lon=...&start=...&end=...   exposure at a location
+- /geography?id=...&start=...&end=...        exposure for a census tract (or other geography)
+- /batch                                     POST a JSON list of point and/or geography queries
+- /stats                                     hot result cache statistics
+
+run with
+python -m air_brain.service --port 8000
+"""
+import argparse
+import copy
+import functools
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from pyproj import Transformer
+
+from air_brain.data.epa_ej import EJ2017
+from air_brain.util.air import PM25
+from air_brain.util.daily_store import DailyStore
+from air_brain.util.loc import CRS, geoms
+
+
+class QueryError(ValueError):
+    """
+    bad or unanswerable query, reported to the client instead of raised
+    """
+
+
+def _day(date):
+    return np.datetime64(pd.Timestamp(date).date(), "D")
+
+
+def _records_by_id(df):
+    """
+    rows of df as dicts keyed on the ID column, with missing values as None so they serialize as JSON null
+    """
+    df = df.astype(object).where(df.notna(), None)
+    return {row.pop("ID"): row for row in df.to_dict(orient="records")}
+
+
+class ExposureService:
+    """
+    in-memory exposure lookups
+    """
+    def __init__(self, air=None, layer="tract_2010", store=None, ej=None, cache_size=4096):
+        """
+        :param air: DailyAir instance, PM25() by default
+        :param layer: str, geometry layer with daily estimates in the daily store
+        :param store: DailyStore to read the estimates from, DailyStore(air, layer) by default
+        :param ej: AbcEJ instance whose tract averages to include, EJ2017() by default
+        :param cache_size: int, number of hot results to keep
+        """
+        air = PM25() if air is None else air
+        self.layer = layer
+        self.to_crs = Transformer.from_crs("EPSG:4326", CRS, always_xy=True)
+
+        # geometry, building the spatial index now rather than on the first query
+        self.geo = geoms.load(layer)
+        self.geo.sindex
+        self.ids = geoms.ids(layer).to_numpy()
+        self.positions = {str(geo_id): pos for pos, geo_id in enumerate(self.ids)}
+
+        # daily estimates as one (day, geography) array, with the columns in the same order as self.ids
+        store = DailyStore(air, layer) if store is None else store
+        estimates = store.estimates()
+        assert estimates is not None, "no daily estimates for {}, run DailyStore.update() first".format(layer)
+        estimates = estimates.reindex(columns=self.ids)
+        self.days = estimates.index.values.astype("datetime64[D]")
+        self.estimates = estimates.to_numpy()
+
+        # sensor sites, for the nearest measurement to a point
+        by_site = air.by_site()
+        sites = air.site_loc().to_crs(CRS)
+        sites = sites.loc[sites.site.isin(by_site.columns)]
+        self.site_names = sites.site.to_numpy()
+        self.site_xy = np.column_stack([sites.geometry.x, sites.geometry.y])
+        self.site_days = by_site.index.values.astype("datetime64[D]")
+        self.site_values = by_site[self.site_names].to_numpy()
+
+        # EJ averages, keyed on the same ID as the geometry
+        # only available for tracts (averaged) and block groups (as provided)
+        ej = EJ2017() if ej is None else ej
+        if layer == "tract_2010":
+            ej_df = pd.read_csv(ej.tract_file)
+        elif layer == "bg_2010":
+            ej_df = pd.read_csv(ej.data_file)[["ID"] + ej.subs + ej.demos]
+        else:
+            ej_df = pd.DataFrame(columns=["ID"])
+        self.ej_year = ej.year
+        self.ej = _records_by_id(ej_df)
+
+        self._geography = functools.lru_cache(maxsize=cache_size)(self._geography_uncached)
+        self._nearest_site = functools.lru_cache(maxsize=cache_size)(self._nearest_site_uncached)
+
+    def _date_range(self, start, end):
+        start = self.days[0] if start is None else _day(start)
+        end = self.days[-1] if end is None else _day(end)
+        if end < start:
+            raise QueryError("end {} is before start {}".format(end, start))
+        return start, end
+
+    def locate(self, lon, lat):
+        """
+        positions into self.ids of the geography containing each point, -1 where there is none
+
+        :param lon: array of longitudes
+        :param lat: array of latitudes
+        """
+        x, y = self.to_crs.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        points = gpd.points_from_xy(np.atleast_1d(x), np.atleast_1d(y), crs=CRS)
+        pt_idx, geo_idx = self.geo.sindex.query(points, predicate="intersects")
+        ret = np.full(len(points), -1)
+        ret[pt_idx[::-1]] = geo_idx[::-1]  # first match wins on shared boundaries
+        return ret, np.column_stack([np.atleast_1d(x), np.atleast_1d(y)])
+
+    def _geography_uncached(self, pos, start, end):
+        lo, hi = np.searchsorted(self.days, [start, end + 1])
+        values = self.estimates[lo:hi, pos]
+        geo_id = self.ids[pos]
+        return {"id": geo_id.item() if hasattr(geo_id, "item") else geo_id,
+                "layer": self.layer,
+                "start": str(start),
+                "end": str(end),
+                "dates": [str(d) for d in self.days[lo:hi]],
+                "values": [None if np.isnan(v) else round(float(v), 3) for v in values],
+                "mean": None if np.isnan(values).all() else round(float(np.nanmean(values)), 3),
+                "ej_{}".format(self.ej_year): self.ej.get(geo_id)}
+
+    def _nearest_site_uncached(self, x, y, start, end):
+        if len(self.site_names) == 0:
+            return None
+        i = int(np.argmin(np.hypot(self.site_xy[:, 0] - x, self.site_xy[:, 1] - y)))
+        lo, hi = np.searchsorted(self.site_days, [start, end + 1])
+        values = self.site_values[lo:hi, i]
+        return {"site": self.site_names[i],
+                "distance_ft": round(float(np.hypot(*(self.site_xy[i] - (x, y)))), 1),
+                "mean": None if np.isnan(values).all() else round(float(np.nanmean(values)), 3)}
+
+    def geography(self, geo_id, start=None, end=None):
+        """
+        daily estimates and EJ averages for one geography between start and end (inclusive)
+        """
+        if str(geo_id) not in self.positions:
+            raise QueryError("no {} with id {}".format(self.layer, geo_id))
+        # copied, so that callers can't change the cached result
+        return copy.deepcopy(self._geography(self.positions[str(geo_id)], *self._date_range(start, end)))
+
+    def points(self, lons, lats, start=None, end=None):
+        """
+        geography exposure and nearest sensor site for many points at once
+        """
+        start, end = self._date_range(start, end)
+        positions, xy = self.locate(lons, lats)
+        ret = []
+        for pos, (x, y) in zip(positions, xy):
+            if pos < 0:
+                ret.append({"error": "point is not in any {}".format(self.layer)})
+                continue
+            result = copy.deepcopy(self._geography(int(pos), start, end))
+            # round so that nearby points share cache entries
+            result["nearest_site"] = self._nearest_site(round(x, -1), round(y, -1), start, end)
+            ret.append(result)
+        return ret
+
+    def point(self, lon, lat, start=None, end=None):
+        result = self.points([lon], [lat], start, end)[0]
+        if "error" in result:
+            raise QueryError(result["error"])
+        return result
+
+    def batch(self, queries):
+        """
+        answer a list of queries, each a dict with either lat and lon, or id, and optionally start and end
+        point queries sharing a date range are located together
+        """
+        if not isinstance(queries, list):
+            raise QueryError("batch must be a list of queries")
+        ret = [None] * len(queries)
+        point_groups = dict()
+        for i, query in enumerate(queries):
+            try:
+                if not isinstance(query, dict):
+                    raise QueryError("query must be an object, not {}".format(json.dumps(query)))
+                if "id" in query:
+                    ret[i] = self.geography(query["id"], query.get("start"), query.get("end"))
+                else:
+                    point = (i, float(query["lon"]), float(query["lat"]))
+                    key = (query.get("start"), query.get("end"))
+                    point_groups.setdefault(key, []).append(point)
+            except (QueryError, KeyError, ValueError, TypeError) as e:
+                ret[i] = {"error": str(e)}
+        for (start, end), group in point_groups.items():
+            idx, lons, lats = zip(*group)
+            try:
+                results = self.points(lons, lats, start, end)
+            except (QueryError, ValueError, TypeError) as e:
+                results = [{"error": str(e)}] * len(idx)
+            for i, result in zip(idx, results):
+                ret[i] = result
+        return ret
+
+    def stats(self):
+        return {"geography_cache": self._geography.cache_info()._asdict(),
+                "nearest_site_cache": self._nearest_site.cache_info()._asdict()}
+
+
+def make_handler(service):
+    """
+    request handler class for an http.server, answering queries with service
+    """
+    class Handler(BaseHTTPRequestHandler):
+        # keep connections open between requests, and don't wait to coalesce small responses
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body):
+            # NaN isn't valid JSON, so fail loudly rather than send it
+            data = json.dumps(body, default=str, allow_nan=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _answer(self, func):
+            try:
+                self._send(200, func())
+            except (QueryError, KeyError, ValueError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/point":
+                self._answer(lambda: service.point(float(params["lon"]), float(params["lat"]),
+                                                   params.get("start"), params.get("end")))
+            elif url.path == "/geography":
+                self._answer(lambda: service.geography(params["id"], params.get("start"), params.get("end")))
+            elif url.path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": "unknown path {}".format(url.path)})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/batch":
+                self._send(404, {"error": "unknown path {}".format(self.path)})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            self._answer(lambda: service.batch(json.loads(self.rfile.read(length))))
+
+        def log_message(self, format, *args):
+            # logging every request to stderr costs more than answering it
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8000, **kwargs):
+    """
+    load the data and serve queries until interrupted
+    """
+    print("Loading exposure data")
+    service = ExposureService(**kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print("Serving on http://{}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--layer", default="tract_2010")
+    args = parser.parse_args()
+    serve(args.host, args.port, layer=args.layer)
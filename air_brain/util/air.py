@@ -7,9 +7,9 @@ import os
 import pandas as pd
 import geopandas as gpd
 
-# TODO this structure is not great
-from air_brain.data.get_data import DATA_DIR
+from air_brain.config import data_dir
 from air_brain.util.loc import distance
+from air_brain.util.sites import SiteRegistry
 
 class DailyAir(metaclass=ABCMeta):
     """
@@ -19,8 +19,12 @@ class DailyAir(metaclass=ABCMeta):
     this incorporates health science knowledge of how pollutants operate on the body to compute a number on a scale
      of 0 - 500 for all pollutants
     """
+    # raw site name -> site name to merge it into, for sites that are believed to be the same sensor
+    # when both report on the same day, the aliased (raw) site's measurement is kept
+    site_aliases = dict()
+
     def __init__(self,
-                 data_dir=DATA_DIR,
+                 data_dir=data_dir,
                  data_file="daily_air_quality.csv",
                  sensor_file="sensor_json.geojson"):
         self.data_dir = data_dir
@@ -52,8 +56,14 @@ class DailyAir(metaclass=ABCMeta):
         - health_effects : str
         """
         filename = os.path.join(self.data_dir, self.data_file)
-        df = pd.read_csv(filename)
-        df.drop(columns="_id", inplace=True)
+        return self.clean_daily_air(pd.read_csv(filename))
+
+    @staticmethod
+    def clean_daily_air(df):
+        """
+        clean up data types and drop unused _id column of rows read from the daily air quality csv
+        """
+        df = df.drop(columns="_id")
         df.date = pd.to_datetime(df.date)
 
         # TODO verify column names, since use them later
@@ -82,26 +92,51 @@ class DailyAir(metaclass=ABCMeta):
         # TODO verify column names, since use them later
         return df
 
-    def daily_air(self):
+    def daily_air(self, all_air=None):
         """
         Subset air quality data to the parameter of interest
+        and merge aliased sites (see site_aliases)
+
+        :param all_air: optional DataFrame as from all_daily_air(), e.g. only newly appended rows,
+            otherwise all_daily_air() is read
 
         :return:
         pandas DataFrame of daily AQI, with columns
         - date : pd.datetime
         - site : str
+        - parameter : str
         - index_value : float
         - description : str
         - health_advisory : str
         - health_effects : str
         """
-        all_air = self.all_daily_air()
-        return all_air.loc[all_air.parameter.isin(self.param_names)].copy()
+        if all_air is None:
+            all_air = self.all_daily_air()
+        df = all_air.loc[all_air.parameter.isin(self.param_names)].copy()
+        if self.site_aliases:
+            # sort aliased sites last, so that they win when both report on the same day
+            aliased = df.site.isin(list(self.site_aliases))
+            df = df.iloc[aliased.argsort(kind="stable")]
+            df["site"] = df.site.replace(self.site_aliases)
+            df = df.drop_duplicates(subset=["date", "site"], keep="last")
+        return df
 
-    def daily_air_gdf(self):
+    def site_registry(self):
+        """
+        which sites reported this parameter when, and where they are
+        see air_brain.util.sites.SiteRegistry
+
+        :return:
+        SiteRegistry
+        """
+        return SiteRegistry.from_daily_air(self)
+
+    def daily_air_gdf(self, air_df=None):
         """
         AQI for each date and site, with geopandas location for each measurement
 
+        :param air_df: optional DataFrame as from daily_air(), otherwise daily_air() is read
+
         :return:
         geopandas dataframe of daily AQI, with columns
         - date : pd.datetime
@@ -112,7 +147,8 @@ class DailyAir(metaclass=ABCMeta):
         - health_effects : str
         - geometry : lat/lon of measurement site
         """
-        air_df = self.daily_air()
+        if air_df is None:
+            air_df = self.daily_air()
         gdf = self.all_site_loc()[["site", "geometry"]]
         df = gdf.merge(air_df, on="site", how="right", validate="1:m")
         return df
@@ -141,18 +177,15 @@ class DailyAir(metaclass=ABCMeta):
         - latitude
         - longitude
         """
-        df = self.all_site_loc()
-        df = df.loc[df.geometry.notna()]
-
-        # what sites have data for this measurement
-        # TODO this is a bit silly and inefficient
-        sites = self.by_site().columns
+        registry = self.site_registry()
         # make sure that all sites have location information
-        for site in sites:
-            assert site in df.site.values, "{} has no location information".format(site)
+        missing = registry.missing_locations()
+        assert not missing, "{} have no location information".format(", ".join(missing))
 
-        ret = df.loc[df.site.isin(sites)][["site", "geometry"]]
-        return ret
+        ret = gpd.GeoDataFrame({"site": list(registry.locations)},
+                               geometry=list(registry.locations.values()),
+                               crs=self.all_site_loc().crs)
+        return ret.loc[ret.site.isin(registry.sites)].reset_index(drop=True)
 
 class PM25(DailyAir):
     """
@@ -172,30 +205,10 @@ class PM25(DailyAir):
     TODO but need to confirm with DHS
     """
     param_names = ["PM25", "PM25(2)", "PM25B", "PM25T", "PM25_640"]
-
-    def daily_air(self):
-        """
-        Subset to just PM 2.5 daily AQI
-
-        :return:
-        pandas DataFrame of daily AQI, with columns
-        - date : pd.datetime
-        - site : str
-        - parameter : str
-        - index_value : float
-        - description : str
-        - health_advisory : str
-        - health_effects : str
-        """
-        pm25 = super().daily_air()
-
-        # TODO danger need to verify with DHS that the below is true
-        # merge sites Lawrenceville and Pittsburgh -> Lawrenceville
-        # for overlap, keep Pittsburgh data, since I assume it's the more recent sensor
-        pm25 = pm25.sort_values("site")
-        pm25.loc[pm25.site == "Pittsburgh", "site"] = "Lawrenceville"
-        pm25 = pm25.drop_duplicates(subset=["date", "site"], keep="last")
-        return pm25
+    # TODO danger need to verify with DHS that this is true
+    # merge sites Lawrenceville and Pittsburgh -> Lawrenceville
+    # for overlap, keep Pittsburgh data, since I assume it's the more recent sensor
+    site_aliases = {"Pittsburgh": "Lawrenceville"}
 
 class SO2(DailyAir):
     """
@@ -0,0 +1,322 @@
+"""
+on disk cache for expensive, deterministic results (overlays, groupbys, interpolations)
+
+results are keyed by a hash of
+- the function and the source code of the module defining it (plus an optional manual version)
+- the arguments, bound to the function's signature so f(x), f(x=x) and f() with default x are the same call
+- the size and modification time of any input files
+so changing any of these is a cache miss
+code in other modules that the function calls is not part of the key, so bump version when that changes
+the results (e.g. how air_brain.util.geom builds a layer)
+
+DataFrames are stored as parquet (GeoDataFrames as GeoParquet), anything else is pickled
+the total size of the cache is bounded, and the least recently used results are evicted first
+
+multiple processes can share the cache: results are written to a temporary file and atomically renamed,
+and eviction happens under a file lock
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from air_brain import config
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, fall back to no locking
+    fcntl = None
+
+# file extension for each storage format
+formats = {"geoparquet": ".geo.parquet",
+           "parquet": ".parquet",
+           "pickle": ".pkl"}
+
+# temporary files older than this (in seconds) were left by a writer that was killed, and are removed on eviction
+STALE_TMP_SECONDS = 3600
+
+
+def _update_hash(h, obj):
+    """
+    add obj to hashlib object h, hashing pandas and numpy data by content
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        try:
+            h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+            if isinstance(obj, pd.DataFrame):
+                h.update(repr((list(obj.columns), list(obj.dtypes))).encode())
+            else:
+                h.update(repr((obj.name, obj.dtype)).encode())
+            return
+        except TypeError:
+            pass
+    elif isinstance(obj, np.ndarray):
+        h.update(repr((obj.shape, obj.dtype)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+        return
+    elif isinstance(obj, (list, tuple)):
+        h.update(repr((type(obj).__name__, len(obj))).encode())
+        for item in obj:
+            _update_hash(h, item)
+        return
+    elif isinstance(obj, dict):
+        h.update(repr(("dict", len(obj))).encode())
+        for k in sorted(obj, key=repr):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+        return
+    h.update(pickle.dumps(obj, protocol=4))
+
+
+def fingerprint(path):
+    """
+    (path, size, modification time) of a file, or None for the size and time if it doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+        return str(path), stat.st_size, stat.st_mtime_ns
+    except FileNotFoundError:
+        return str(path), None, None
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(func):
+    """
+    hash of the source code of the module defining func, so that editing func or the helpers next to it
+    invalidates its cached results
+    """
+    try:
+        source = inspect.getsource(inspect.getmodule(func)).encode()
+    except (OSError, TypeError):
+        try:
+            source = inspect.getsource(func).encode()
+        except (OSError, TypeError):
+            source = func.__code__.co_code
+    return hashlib.sha256(source).hexdigest()
+
+
+def bind(func, args, kwargs):
+    """
+    arguments of a call of func by parameter name, with defaults filled in
+
+    :return: dict of parameter name -> value
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+class ResultCache:
+    """
+    size bounded, least recently used cache of results in cache_dir
+
+    "used" is tracked by the modification time of each file, which is bumped on every hit
+    """
+    def __init__(self, cache_dir=config.cache_dir, max_bytes=config.cache_max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, func, arguments, files=(), version=None):
+        """
+        hex digest identifying a call of func
+
+        :param arguments: dict of parameter name -> value, see bind
+        """
+        h = hashlib.sha256()
+        h.update("{}.{}".format(func.__module__, func.__qualname__).encode())
+        h.update(code_version(func).encode())
+        _update_hash(h, version)
+        _update_hash(h, arguments)
+        _update_hash(h, [fingerprint(f) for f in files])
+        return h.hexdigest()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, "{}{}".format(key, formats[fmt]))
+
+    def _entries(self):
+        """
+        list of (last used time, size, path) for every result in the cache
+        """
+        ret = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return ret
+        for name in names:
+            if not name.endswith(tuple(formats.values())):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # evicted by another process
+                continue
+            ret.append((stat.st_mtime, stat.st_size, path))
+        return ret
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """
+        :return: (True, result) if key is in the cache, otherwise (False, None)
+        """
+        for fmt in formats:
+            path = self._path(key, fmt)
+            try:
+                if fmt == "geoparquet":
+                    value = gpd.read_parquet(path)
+                elif fmt == "parquet":
+                    value = pd.read_parquet(path)
+                else:
+                    with open(path, "rb") as f:
+                        value = pickle.load(f)
+            except FileNotFoundError:
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            self.hits += 1
+            return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        """
+        store value under key, then evict old results if the cache is too big
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            fmt = "pickle"
+            if isinstance(value, pd.DataFrame):
+                try:
+                    value.to_parquet(tmp)
+                    fmt = "geoparquet" if isinstance(value, gpd.GeoDataFrame) else "parquet"
+                except (ValueError, TypeError, ImportError):
+                    # e.g. non-string column names or object columns parquet can't store
+                    pass
+            if fmt == "pickle":
+                with open(tmp, "wb") as f:
+                    pickle.dump(value, f, protocol=4)
+            os.replace(tmp, self._path(key, fmt))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+
+    def _remove_stale_tmp(self):
+        """
+        remove temporary files left behind by writers killed before renaming them into place
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - STALE_TMP_SECONDS
+        for name in names:
+            if not name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """
+        remove least recently used results until the cache is within max_bytes,
+        and any stale temporary files
+        """
+        with self._locked():
+            self._remove_stale_tmp()
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        """
+        remove every result in the cache
+        """
+        with self._locked():
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """
+        hit / miss statistics for this process, and the current contents of the cache
+
+        :return: dict
+        """
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes}
+
+    def cached(self, files=None, version=None):
+        """
+        decorator to cache the results of a function
+
+        :param files: optional list of input file paths, or a function returning that list, whose size and
+            modification time are part of the key
+            the function is called with every argument of the decorated function by keyword, defaults included
+        :param version: optional value to bump by hand, e.g. when a function's results change because of
+            code in another module
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                arguments = bind(func, args, kwargs)
+                input_files = files(**arguments) if callable(files) else (files or [])
+                key = self.key(func, arguments, input_files, version)
+                found, value = self.get(key)
+                if not found:
+                    value = func(*args, **kwargs)
+                    self.put(key, value)
+                return value
+            wrapper.cache = self
+            return wrapper
+        return decorator
+
+
+# shared cache for the project
+cache = ResultCache()
+cached = cache.cached
@@ -0,0 +1,283 @@
+"""
+incremental processing of the WPRDC daily air quality file and its derived products
+
+the daily AQI file only grows at the end, so instead of re-parsing all of history every night
+the store remembers how far into the file it has read and a hash of everything up to there,
+and only parses the rows appended since
+the days those rows fall on ("dirty" days) are then
+- added to the store of daily measurements, as read (before merging aliased sites, which is done on reading,
+  so a late row for one of the sites of an alias is merged with the other's rows as if read all at once)
+- block kriged to the geography layer (see air_brain.util.interp)
+- summed into the annual sums of the years they fall in, from those years' month partitions
+so other than hashing the file, the cost of a refresh scales with the number of new days, not with the total history
+every step can be rerun, so an interrupted update is finished by the next one
+
+measurements and estimates are partitioned by month, so a refresh only rewrites the months it touches
+if the file changed anywhere other than at the end, or the store is from an older STORE_VERSION,
+the store is rebuilt from scratch
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from air_brain.config import data_dir
+from air_brain.util.geom import layers
+from air_brain.util.interp import BlockSupport, block_krige, check_variogram_model, day_measurements
+
+# bytes read at a time when hashing the part of the source file that was already processed
+CHUNK_BYTES = 2 ** 24
+
+# bump when the layout or meaning of the stored files changes, so existing stores are rebuilt
+STORE_VERSION = 2
+
+
+def _month(date):
+    return pd.Timestamp(date).strftime("%Y-%m")
+
+
+class DailyStore:
+    """
+    incrementally maintained daily measurements, daily geography estimates and annual means
+    for one DailyAir parameter and one geometry layer
+    """
+    def __init__(self, air,
+                 layer="tract_2010",
+                 store_dir=data_dir / "daily_store",
+                 cell_size=1000,
+                 min_sites=3,
+                 variogram_model="gaussian"):
+        """
+        :param air: DailyAir instance, e.g. PM25()
+        :param layer: str, geometry layer to estimate for, see air_brain.util.geom.layers
+        :param store_dir: directory to keep the store in
+        :param cell_size: float, see BlockSupport
+        :param min_sites: int, days with fewer reporting sites get no estimate
+        :param variogram_model: str, one of air_brain.util.interp.bounded_models
+        """
+        check_variogram_model(variogram_model)
+        self.air = air
+        self.layer = layer
+        self.store_dir = os.path.join(store_dir, "{}_{}".format(type(air).__name__, layer))
+        self.cell_size = cell_size
+        self.min_sites = min_sites
+        self.variogram_model = variogram_model
+
+    @property
+    def source_file(self):
+        return os.path.join(self.air.data_dir, self.air.data_file)
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.store_dir, "manifest.json")
+
+    def annual_file(self, stat):
+        """
+        string full path to the running annual stat (sum or count) of the daily estimates
+        """
+        return os.path.join(self.store_dir, "annual_{}.parquet".format(stat))
+
+    def partition_file(self, kind, month):
+        """
+        string full path to the partition of kind (measurements or estimates) for month (YYYY-MM)
+        """
+        return os.path.join(self.store_dir, kind, "{}.parquet".format(month))
+
+    def _ids(self, columns):
+        """
+        geography IDs of the layer from the string column names they are stored under in parquet
+        """
+        return pd.Index(columns.astype(layers[self.layer]["id_type"]), name=columns.name)
+
+    def _manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _new_rows(self):
+        """
+        rows appended to the source file since the last update
+
+        the bytes already processed are hashed on the way to the new rows, and compared to the hash saved
+        in the manifest, so a change anywhere before the end of the file is caught
+
+        :return: pandas DataFrame as from DailyAir.all_daily_air(), and the manifest to save once they are processed
+            or None for the DataFrame if the store needs to be rebuilt
+        """
+        manifest = self._manifest()
+        if manifest is not None and manifest.get("version") != STORE_VERSION:
+            return None, None
+        h = hashlib.sha256()
+        with open(self.source_file, "rb") as f:
+            header = f.readline()
+            h.update(header)
+            if manifest is None:
+                offset = len(header)
+            else:
+                offset = manifest["offset"]
+                remaining = offset - len(header)
+                while remaining > 0:
+                    chunk = f.read(min(remaining, CHUNK_BYTES))
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    remaining -= len(chunk)
+                if remaining > 0 or h.hexdigest() != manifest.get("prefix_hash"):
+                    return None, None
+            tail = f.read()
+        # only take complete lines, in case the file is still being written
+        tail = tail[:tail.rfind(b"\n") + 1]
+        h.update(tail)
+        new_manifest = {"version": STORE_VERSION, "offset": offset + len(tail), "prefix_hash": h.hexdigest()}
+        df = pd.read_csv(io.BytesIO(header + tail))
+        return self.air.clean_daily_air(df), new_manifest
+
+    def _stored_months(self, kind):
+        """
+        sorted months (YYYY-MM) with a partition of kind (measurements or estimates)
+        """
+        try:
+            names = os.listdir(os.path.join(self.store_dir, kind))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".parquet")] for name in names if name.endswith(".parquet"))
+
+    def _read_partitions(self, kind, months):
+        frames = [pd.read_parquet(self.partition_file(kind, month)) for month in months
+                  if os.path.exists(self.partition_file(kind, month))]
+        return pd.concat(frames) if frames else None
+
+    def _write_partitions(self, kind, df, months):
+        os.makedirs(os.path.join(self.store_dir, kind), exist_ok=True)
+        for month in months:
+            part = df.loc[df.index.strftime("%Y-%m") == month] if kind == "estimates" \
+                else df.loc[df.date.dt.strftime("%Y-%m") == month]
+            tmp = self.partition_file(kind, month) + ".tmp"
+            part.to_parquet(tmp)
+            os.replace(tmp, self.partition_file(kind, month))
+
+    def rebuild(self):
+        """
+        drop everything and process the whole source file
+        """
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        return self.update()
+
+    def update(self):
+        """
+        process rows appended to the source file since the last update
+
+        :return: pandas DatetimeIndex of the days that were (re)processed
+        """
+        new_all, manifest = self._new_rows()
+        if new_all is None:
+            print("{} changed other than by appending, or the store is out of date, rebuilding {}".format(
+                self.source_file, self.store_dir))
+            return self.rebuild()
+        new = new_all.loc[new_all.parameter.isin(self.air.param_names)]
+        dirty = pd.DatetimeIndex(sorted(new.date.unique()))
+        if len(dirty):
+            print("Updating {} with {} days".format(self.store_dir, len(dirty)))
+            months = sorted({_month(date) for date in dirty})
+            # measurements: merge the new rows into the months they fall in, before merging aliased sites
+            # rows already stored are dropped in favor of the new ones, so rerunning after an interrupted update
+            # (which re-reads the same rows) doesn't duplicate them
+            measurements = pd.concat([self._read_partitions("measurements", months), new])
+            measurements = measurements.drop_duplicates(subset=["date", "site", "parameter"], keep="last")
+            self._write_partitions("measurements", measurements, months)
+
+            # merge aliased sites across old and new rows of the dirty days
+            dirty_air = self.air.daily_air(measurements.loc[measurements.date.isin(dirty)])
+            self._update_estimates(dirty_air, dirty, months)
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.manifest_file, "w") as f:
+            json.dump(manifest, f)
+        return dirty
+
+    def _update_estimates(self, measurements, dirty, months):
+        """
+        krige the dirty days, and recompute the annual sums of the years they fall in
+        """
+        support = BlockSupport(self.layer, self.cell_size)
+        days = day_measurements(self.air, measurements)
+        new = pd.DataFrame(np.nan, index=pd.Index(dirty, name="date"), columns=support.ids.astype(str))
+        for date in dirty:
+            if date in days and len(days[date][1]) >= self.min_sites:
+                new.loc[date], _ = block_krige(*days[date], support, self.variogram_model)
+
+        estimates = self._read_partitions("estimates", months)
+        if estimates is None:
+            estimates = new.iloc[:0]
+        estimates = pd.concat([estimates.drop(index=dirty, errors="ignore"), new]).sort_index()
+        self._write_partitions("estimates", estimates, months)
+
+        # annual sums of the touched years, from all of their month partitions rather than by adding to the
+        # stored sums, so they are right even if an earlier update was interrupted after writing the estimates
+        sums, counts = self.annual_sums()
+        stored = self._stored_months("estimates")
+        for year in sorted(set(dirty.year)):
+            year_df = self._read_partitions("estimates", [m for m in stored if m.startswith("{}-".format(year))])
+            sums.loc[year] = year_df.sum().reindex(sums.columns).to_numpy()
+            counts.loc[year] = year_df.notna().sum().reindex(sums.columns).to_numpy()
+        for stat, df in [("sum", sums), ("count", counts)]:
+            tmp = self.annual_file(stat) + ".tmp"
+            df.sort_index().to_parquet(tmp)
+            os.replace(tmp, self.annual_file(stat))
+
+    def annual_sums(self):
+        """
+        annual sums and counts of the daily estimates
+
+        :return: two pandas DataFrames (sums and counts), indexed on year, with one column per geography ID
+        """
+        if os.path.exists(self.annual_file("sum")):
+            return pd.read_parquet(self.annual_file("sum")), pd.read_parquet(self.annual_file("count"))
+        support = BlockSupport(self.layer, self.cell_size)
+        empty = pd.DataFrame(columns=support.ids.astype(str), index=pd.Index([], name="year", dtype=int),
+                             dtype=float)
+        return empty, empty.copy()
+
+    def annual_means(self):
+        """
+        mean daily estimate for each year and geography, over days with an estimate
+
+        :return: pandas DataFrame, indexed on year, with one column per geography ID
+        """
+        sums, counts = self.annual_sums()
+        ret = sums / counts.replace(0, np.nan)
+        ret.columns = self._ids(ret.columns)
+        return ret
+
+    def measurements(self, start, end):
+        """
+        stored daily measurements between start and end (inclusive), as from DailyAir.daily_air()
+        """
+        months = [_month(m) for m in pd.period_range(start, end, freq="M").to_timestamp()]
+        df = self._read_partitions("measurements", months)
+        if df is None:
+            return None
+        return self.air.daily_air(df.loc[(df.date >= pd.Timestamp(start)) & (df.date <= pd.Timestamp(end))])
+
+    def estimates(self, start=None, end=None):
+        """
+        stored daily estimates between start and end (inclusive), all of them by default
+
+        :return: pandas DataFrame, indexed on date, with one column per geography ID
+        """
+        if start is None or end is None:
+            months = self._stored_months("estimates")
+        else:
+            months = [_month(m) for m in pd.period_range(start, end, freq="M").to_timestamp()]
+        df = self._read_partitions("estimates", months)
+        if df is None:
+            return None
+        df = df.sort_index().loc[start and pd.Timestamp(start):end and pd.Timestamp(end)]
+        df.columns = self._ids(df.columns)
+        return df
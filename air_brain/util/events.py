@@ -0,0 +1,250 @@
+"""
+counts of health events by geography and period, for any of the health datasets
+
+the health datasets each come at their own resolution
+- accidental_overdose: timestamped, by zip code
+- asthma: annual (2017 only), by census tract
+ems (quarterly, by census block group) and covid_deaths (dated, by neighborhood) fit the same way,
+but have no reader in datasets until their column names are checked against the WPRDC files
+EventTensor holds any of them in one form, a sparse (geography x period x category) tensor of counts,
+stored as a sparse matrix with one row per geography and one column per (period, category), so that
+- binning to a coarser calendar period is one sparse product on the columns
+- moving to another geography layer is one sparse product on the rows, with the area crosswalk
+  (see air_brain.util.loc.crosswalk), which allocates each geography's counts by area
+- aligning with daily exposures (e.g. DailyStore.estimates()) is one call to align
+
+events = event_tensor("accidental_overdose", freq="M", layer="tract_2010")
+df = events.align(DailyStore(PM25()).estimates())
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from air_brain.config import data_dir
+from air_brain.util.loc import crosswalk, geoms
+
+# calendar periods, finest first
+# counts can only be binned to the same or a coarser period, and periods are binned by their first day
+# (so a week that straddles two months is counted in the first)
+freqs = ["D", "W", "M", "Q", "Y"]
+
+# year of the asthma file, see air_brain.data.wprdc.csv_data
+ASTHMA_YEAR = 2017
+
+
+def _check_freq(freq, native):
+    if freqs.index(freq[0].upper()) < freqs.index(native[0].upper()):
+        raise ValueError("can't bin counts by {} to the finer period {}".format(native, freq))
+
+
+def _bin(times, freq):
+    """
+    period at freq of each time (timestamps or periods), as a pandas PeriodIndex
+    """
+    if isinstance(getattr(times, "dtype", None), pd.PeriodDtype):
+        times = pd.PeriodIndex(times).start_time
+    return pd.DatetimeIndex(times).to_period(freq)
+
+
+def _layer_ids(layer):
+    return pd.Index(geoms.ids(layer).unique(), name="ID")
+
+
+class EventTensor:
+    """
+    sparse counts of events by geography, period and category
+    """
+    def __init__(self, counts, layer, periods, categories, freq):
+        """
+        :param counts: scipy sparse matrix of shape (geography, period * category),
+            with the count for period t and category c in column t * len(categories) + c
+        :param layer: str, geometry layer of the rows, see air_brain.util.geom.layers
+        :param periods: pandas PeriodIndex, consecutive periods at freq
+        :param categories: pandas Index
+        :param freq: str, one of freqs
+        """
+        self.counts = sparse.csr_matrix(counts)
+        self.counts.eliminate_zeros()
+        self.layer = layer
+        self.ids = _layer_ids(layer)
+        self.periods = periods
+        self.categories = categories
+        self.freq = freq
+        assert self.counts.shape == (len(self.ids), len(periods) * len(categories)), "counts don't match the axes"
+
+    @classmethod
+    def from_events(cls, geo, times, layer, freq, categories=None, counts=None):
+        """
+        bin events (or rows of counts) into a tensor
+
+        :param geo: array of geography IDs in layer, one per row
+        :param times: array of timestamps or periods, one per row
+        :param layer: str, geometry layer of geo
+        :param freq: str, one of freqs
+        :param categories: optional array of the category of each row, everything is one category "count" by default
+        :param counts: optional array of the count of each row, one event per row by default
+        :return: EventTensor
+        """
+        ids = _layer_ids(layer)
+        geo_pos = ids.get_indexer(pd.Index(geo))
+        periods = _bin(times, freq)
+        if categories is None:
+            cat_codes, cat_index = np.zeros(len(geo_pos), dtype=np.int64), pd.Index(["count"])
+        else:
+            cat_codes, cat_index = pd.factorize(np.asarray(categories), sort=True)
+            cat_index = pd.Index(cat_index)
+        counts = np.ones(len(geo_pos)) if counts is None else np.asarray(counts, dtype=float)
+
+        keep = (geo_pos >= 0) & ~periods.isna() & (cat_codes >= 0) & ~np.isnan(counts)
+        if not keep.all():
+            print("Dropping {} of {} rows with no {} match, period or category".format(
+                (~keep).sum(), len(keep), layer))
+        assert keep.any(), "no rows left to count"
+        periods = periods[keep]
+        period_index = pd.period_range(periods.min(), periods.max(), freq=freq)
+        t = periods.asi8 - period_index[0].ordinal
+        n_cat = len(cat_index)
+        # duplicate coordinates are summed on conversion to csr
+        matrix = sparse.coo_matrix((counts[keep], (geo_pos[keep], t * n_cat + cat_codes[keep])),
+                                   shape=(len(ids), len(period_index) * n_cat))
+        return cls(matrix.tocsr(), layer, period_index, cat_index, freq)
+
+    @property
+    def shape(self):
+        return len(self.ids), len(self.periods), len(self.categories)
+
+    def to_freq(self, freq):
+        """
+        counts binned to the coarser period freq
+        """
+        _check_freq(freq, self.freq)
+        new = _bin(self.periods, freq)
+        new_index = pd.period_range(new.min(), new.max(), freq=freq)
+        n_cat = len(self.categories)
+        old_cols = np.arange(len(self.periods) * n_cat)
+        new_cols = np.repeat(new.asi8 - new_index[0].ordinal, n_cat) * n_cat + np.tile(np.arange(n_cat), len(self.periods))
+        binning = sparse.csr_matrix((np.ones(len(old_cols)), (old_cols, new_cols)),
+                                    shape=(len(old_cols), len(new_index) * n_cat))
+        return EventTensor(self.counts @ binning, self.layer, new_index, self.categories, freq)
+
+    def to_layer(self, layer):
+        """
+        counts moved to geography layer, allocating each geography's counts by the share of its area
+        in each geography of layer (so counts are no longer whole numbers)
+        """
+        if layer == self.layer:
+            return self
+        cw = crosswalk(self.layer, layer)
+        dst_ids = _layer_ids(layer)
+        weights = sparse.csr_matrix((cw.weight.to_numpy(), (self.ids.get_indexer(cw.src), dst_ids.get_indexer(cw.dst))),
+                                    shape=(len(self.ids), len(dst_ids)))
+        return EventTensor(weights.T @ self.counts, layer, self.periods, self.categories, self.freq)
+
+    def total(self):
+        """
+        counts summed over categories, as one category "count"
+        """
+        summing = sparse.kron(sparse.identity(len(self.periods)), np.ones((len(self.categories), 1)), format="csr")
+        return EventTensor(self.counts @ summing, self.layer, self.periods, pd.Index(["count"]), self.freq)
+
+    def dense(self):
+        """
+        :return: numpy array of shape (geography, period, category)
+        """
+        return self.counts.toarray().reshape(self.shape)
+
+    def to_frame(self):
+        """
+        :return:
+        pandas DataFrame of the non-zero counts, with columns
+        - ID: geography ID in self.layer
+        - period
+        - category
+        - count
+        """
+        coo = self.counts.tocoo()
+        t, c = np.divmod(coo.col, len(self.categories))
+        return pd.DataFrame({"ID": self.ids[coo.row],
+                             "period": self.periods[t],
+                             "category": self.categories[c],
+                             "count": coo.data})
+
+    def align(self, exposure):
+        """
+        counts for every geography and period, alongside the average daily exposure over the period
+
+        :param exposure: pandas DataFrame indexed on date, with one column per geography ID of self.layer,
+            e.g. DailyStore(air, self.layer).estimates()
+        :return:
+        pandas DataFrame with columns
+        - ID: geography ID in self.layer
+        - period
+        - one column of counts per category, including zeros
+        - exposure: mean of the daily exposures in the period, NaN if there are none
+        - exposure_days: number of days in the period with an exposure
+        """
+        grouped = exposure.groupby(_bin(exposure.index, self.freq))
+        mean = grouped.mean().reindex(index=self.periods, columns=self.ids)
+        days = grouped.count().reindex(index=self.periods, columns=self.ids).fillna(0)
+
+        n_geo, n_period, n_cat = self.shape
+        df = pd.DataFrame(self.dense().reshape(-1, n_cat), columns=self.categories)
+        df.insert(0, "period", np.tile(self.periods, n_geo))
+        df.insert(0, "ID", np.repeat(self.ids.to_numpy(), n_period))
+        # exposures are (period, geography), the rows are geography major
+        df["exposure"] = mean.to_numpy().T.ravel()
+        df["exposure_days"] = days.to_numpy().T.ravel().astype(int)
+        return df
+
+
+def _read_asthma():
+    df = pd.read_csv(os.path.join(data_dir, "asthma.csv"))
+    # Total_members is the population covered, not a count of events
+    df = df.melt(id_vars="Census_tract",
+                 value_vars=["ED_visits", "ED_hosp", "UC_visits", "Asthma_use"],
+                 var_name="category",
+                 value_name="count")
+    df["geo"] = df.Census_tract
+    df["time"] = pd.Timestamp(ASTHMA_YEAR, 1, 1)
+    return df
+
+
+def _read_overdose():
+    df = pd.read_csv(os.path.join(data_dir, "accidental_overdose.csv"))
+    df["time"] = pd.to_datetime(df.death_date_and_time, errors="coerce")
+    # zip+4 and other junk to five digit zip codes
+    df["geo"] = pd.to_numeric(df.incident_zip.astype(str).str[:5], errors="coerce")
+    return df
+
+
+# how to read each health dataset, see air_brain.data.wprdc.csv_data
+# - reader: function returning a DataFrame with columns geo (ID in layer) and time,
+#   optionally category and count (otherwise each row is one event)
+# - layer: geometry layer the dataset is located in
+# - freq: finest period the dataset can be binned to
+datasets = {
+    "asthma": {"reader": _read_asthma, "layer": "tract_2010", "freq": "Y"},
+    "accidental_overdose": {"reader": _read_overdose, "layer": "zip", "freq": "D"},
+}
+
+
+def event_tensor(name, freq=None, layer=None, category=None):
+    """
+    counts of events in a health dataset by geography, period and category
+
+    :param name: str, key of datasets
+    :param freq: optional str, one of freqs, the dataset's own period by default
+    :param layer: optional str, geometry layer to move the counts to, the dataset's own layer by default
+    :param category: optional str, column to split counts by (e.g. "sex" for accidental_overdose),
+        by default the dataset's own categories if it has them, otherwise everything is one category
+    :return: EventTensor
+    """
+    spec = datasets[name]
+    freq = spec["freq"] if freq is None else freq
+    _check_freq(freq, spec["freq"])
+    df = spec["reader"]()
+    categories = df[category] if category is not None else df.get("category")
+    tensor = EventTensor.from_events(df.geo, df.time, spec["layer"], freq, categories, df.get("count"))
+    return tensor if layer is None else tensor.to_layer(layer)
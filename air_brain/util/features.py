@@ -0,0 +1,150 @@
+"""
+distributed lag and rolling window features for daily exposure series
+
+health outcome models want the same series at many lags and window lengths
+doing that with repeated shift / rolling calls on the DailyAir.by_site pivot copies the whole frame per feature
+instead
+- lags are a strided view onto one padded copy of the data
+- rolling aggregates come from one cumulative sum per series, so any window is a difference of two rows
+and everything is computed for all columns (sites, tracts, ...) at once
+"""
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _daily(df):
+    """
+    reindex a date indexed DataFrame to every day between its first and last date,
+    so that positions along the first axis are days
+    """
+    full = pd.date_range(df.index.min(), df.index.max(), freq="D")
+    if len(full) == len(df.index) and (full == df.index).all():
+        return df
+    return df.reindex(full)
+
+
+def _min_count(window, min_coverage):
+    """
+    minimum number of non-missing days in a window of length window
+    """
+    return max(1, int(np.ceil(min_coverage * window)))
+
+
+class FeatureBuilder:
+    """
+    lag and rolling window features of every column of a date indexed DataFrame,
+    e.g. DailyAir.by_site() or daily tract estimates
+
+    arrays are shaped (day, column, feature)
+    """
+    def __init__(self, df):
+        df = _daily(df)
+        self.index = df.index
+        self.columns = df.columns
+        self.values = np.ascontiguousarray(df.to_numpy(dtype=np.float64))
+        self._cumsums = None
+
+    def lags(self, max_lag):
+        """
+        distributed lag matrix for lags 0 .. max_lag, as a read-only view (no copy per lag)
+
+        :param max_lag: int
+        :return: numpy array of shape (day, column, max_lag + 1), where [t, g, l] is day t - l for column g
+            lags before the first day are NaN
+        """
+        pad = np.full((max_lag, self.values.shape[1]), np.nan)
+        padded = np.concatenate([pad, self.values])
+        # window t covers padded days t .. t + max_lag, i.e. original days t - max_lag .. t
+        windows = sliding_window_view(padded, max_lag + 1, axis=0)
+        return windows[:, :, ::-1]
+
+    def _cumsum(self):
+        """
+        cumulative sum and count of non-missing values, with a leading row of zeros
+        so that the window (a, b] is cum[b] - cum[a]
+        """
+        if self._cumsums is None:
+            present = ~np.isnan(self.values)
+            zeros = np.zeros((1, self.values.shape[1]))
+            sums = np.concatenate([zeros, np.cumsum(np.where(present, self.values, 0), axis=0)])
+            counts = np.concatenate([zeros, np.cumsum(present, axis=0)])
+            self._cumsums = (sums, counts)
+        return self._cumsums
+
+    def _positions(self, columns):
+        if columns is None:
+            return slice(None)
+        positions = self.columns.get_indexer(columns)
+        assert (positions >= 0).all(), "unknown columns"
+        return positions
+
+    def rolling_mean(self, windows, min_coverage=0.75, columns=None, out=None):
+        """
+        trailing means over each window length, ignoring missing days
+
+        :param windows: list of int window lengths in days, e.g. [3, 7, 30]
+        :param min_coverage: float, fraction of days in a window that must be non-missing, otherwise NaN
+        :param columns: optional subset of self.columns
+        :param out: optional preallocated array of shape (day, column, len(windows)) to fill
+        :return: numpy array of shape (day, column, len(windows)), where [t, g, w] is the mean of days
+            t - windows[w] + 1 .. t for column g
+        """
+        sums, counts = self._cumsum()
+        positions = self._positions(columns)
+        sums, counts = sums[:, positions], counts[:, positions]
+        n_days = self.values.shape[0]
+        if out is None:
+            out = np.empty((n_days, sums.shape[1], len(windows)))
+        for i, window in enumerate(windows):
+            # days before the first day count as missing
+            lower = np.maximum(np.arange(1, n_days + 1) - window, 0)
+            n = counts[1:] - counts[lower]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                np.divide(sums[1:] - sums[lower], n, out=out[:, :, i])
+            out[:, :, i][n < _min_count(window, min_coverage)] = np.nan
+        return out
+
+    def lag_coverage(self, max_lag):
+        """
+        fraction of non-missing days among lags 0 .. max_lag, e.g. to drop rows of the lag matrix
+
+        :return: numpy array of shape (day, column)
+        """
+        _, counts = self._cumsum()
+        lower = np.maximum(np.arange(1, self.values.shape[0] + 1) - (max_lag + 1), 0)
+        return (counts[1:] - counts[lower]) / (max_lag + 1)
+
+    def to_frame(self, max_lag=None, windows=None, min_coverage=0.75, columns=None):
+        """
+        features as a long DataFrame for modelling, one row per (date, column)
+        only materializes the requested columns, so large builds can be done in blocks of columns
+
+        :param max_lag: optional int, include lag_0 .. lag_{max_lag}
+        :param windows: optional list of int, include mean_{window} for each window
+        :param min_coverage: float, see rolling_mean
+        :param columns: optional subset of self.columns
+        :return: pandas DataFrame indexed on (date, column)
+        """
+        positions = self._positions(columns)
+        index = pd.MultiIndex.from_product([self.index, self.columns[positions]],
+                                           names=["date", self.columns.name or "column"])
+        ret = dict()
+        if max_lag is not None:
+            lags = self.lags(max_lag)[:, positions, :]
+            for lag in range(max_lag + 1):
+                ret["lag_{}".format(lag)] = lags[:, :, lag].ravel()
+        if windows is not None:
+            means = self.rolling_mean(windows, min_coverage, columns=columns)
+            for i, window in enumerate(windows):
+                ret["mean_{}".format(window)] = means[:, :, i].ravel()
+        return pd.DataFrame(ret, index=index)
+
+    def iter_frames(self, block_size=50, **kwargs):
+        """
+        to_frame for blocks of block_size columns at a time, to bound memory
+
+        :return: generator of pandas DataFrames, see to_frame
+        """
+        for start in range(0, len(self.columns), block_size):
+            yield self.to_frame(columns=self.columns[start:start + block_size], **kwargs)
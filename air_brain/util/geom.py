@@ -0,0 +1,152 @@
+"""
+registry of the geometry layers used across the project
+
+reading a shapefile / geojson and reprojecting it is slow, and every notebook and overlay was doing it
+so the first time a layer is loaded, it is projected to the canonical CRS and written to GeoParquet,
+along with a simplified copy for plotting
+after that, loading a layer is a binary columnar read with no reprojection
+
+layers are kept in memory once loaded, so their spatial index (which geopandas builds lazily)
+is only built on the first spatial query and then reused
+"""
+import os
+
+import geopandas as gpd
+
+from air_brain.config import data_dir
+
+# source files and how to unify them for each layer
+# - file: source file as downloaded
+# - rename: column renames, so that the id column is the same across datasets
+# - id: column identifying each geometry (None if the layer has no natural id)
+# - id_type: type to cast the id column to, e.g. int to match AbcEJ IDs
+layers = {
+    "tract_2010": {"file": data_dir / "tract_2010" / "tl_2010_42003_tract10.shp",
+                   "rename": {"GEOID10": "ID"},
+                   "id": "ID",
+                   "id_type": int},
+    "bg_2010": {"file": data_dir / "tl_2010_42003_bg10" / "tl_2010_42003_bg10.shp",
+                "rename": {"GEOID10": "ID"},
+                "id": "ID",
+                "id_type": int},
+    "zip": {"file": data_dir / "zipcodes.geojson",
+            "rename": {},
+            "id": "ZIP",
+            "id_type": int},
+    # TODO verify the name column in the WPRDC municipality boundaries
+    "municipality": {"file": data_dir / "municipality.geojson",
+                     "rename": {},
+                     "id": "LABEL",
+                     "id_type": str},
+    "neighborhood": {"file": data_dir / "neighborhood.geojson",
+                     "rename": {},
+                     "id": "hood",
+                     "id_type": str},
+    "county": {"file": data_dir / "county.geojson",
+               "rename": {},
+               "id": None,
+               "id_type": None},
+    "sensors": {"file": data_dir / "sensor_json.geojson",
+                "rename": {"SiteName": "site"},
+                "id": "site",
+                "id_type": str},
+}
+
+# tolerance for the simplified plotting geometries, in units of the CRS (feet for EPSG:2272)
+SIMPLIFY_TOLERANCE = 50
+
+
+class GeomRegistry:
+    """
+    pre-projected geometry layers, keyed by layer name (see layers above)
+
+    cached GeoParquet files are rebuilt whenever the source file is newer than the cache
+    """
+    def __init__(self, crs, cache_dir=data_dir / "geom_cache"):
+        self.crs = crs
+        self.cache_dir = cache_dir
+        self._loaded = dict()
+
+    def cache_file(self, name, simplified=False):
+        """
+        string full path to the cached GeoParquet file for layer name
+        """
+        suffix = "_simple" if simplified else ""
+        return os.path.join(self.cache_dir, "{}{}.parquet".format(name, suffix))
+
+    def source_file(self, name):
+        """
+        string full path to the original file for layer name
+        """
+        return str(layers[name]["file"])
+
+    def is_stale(self, name):
+        """
+        True if the cache for layer name is missing or older than the source file
+        a cache whose source file is missing (e.g. only the cache was copied over) is used as is
+        """
+        try:
+            source_mtime = os.path.getmtime(self.source_file(name))
+        except FileNotFoundError:
+            source_mtime = None
+        for simplified in [False, True]:
+            cache_file = self.cache_file(name, simplified)
+            if not os.path.exists(cache_file):
+                return True
+            if source_mtime is not None and os.path.getmtime(cache_file) < source_mtime:
+                return True
+        return False
+
+    def build(self, name):
+        """
+        read layer name from its source file, unify columns, project to self.crs
+        and write out the full and simplified versions
+        """
+        spec = layers[name]
+        print("Building {} geometry cache from {}".format(name, spec["file"]))
+        gdf = gpd.read_file(spec["file"]).rename(columns=spec["rename"])
+        if spec["id"] is not None:
+            assert spec["id"] in gdf.columns, "{} not in columns for {}".format(spec["id"], name)
+            gdf[spec["id"]] = gdf[spec["id"]].astype(spec["id_type"])
+        gdf = gdf.to_crs(self.crs)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        gdf.to_parquet(self.cache_file(name))
+        simple = gdf.copy()
+        simple["geometry"] = simple.geometry.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+        simple.to_parquet(self.cache_file(name, simplified=True))
+
+    def load(self, name, simplified=False):
+        """
+        load layer name, projected to self.crs
+
+        the returned GeoDataFrame is shared between calls, so copy it before modifying it in place
+
+        :param name: str, key of layers
+        :param simplified: bool, load the simplified geometry intended for plotting
+        :return: geopandas GeoDataFrame
+        """
+        key = (name, simplified)
+        if key not in self._loaded:
+            if self.is_stale(name):
+                self.build(name)
+            self._loaded[key] = gpd.read_parquet(self.cache_file(name, simplified))
+        return self._loaded[key]
+
+    def ids(self, name):
+        """
+        id column of layer name, in the same order as the rows of load(name)
+        """
+        return self.load(name)[layers[name]["id"]]
+
+    def query(self, name, geometry, predicate="intersects", **kwargs):
+        """
+        positions (into load(name)) of the geometries of layer name that satisfy predicate against geometry
+        the spatial index is built on the first call for each layer
+
+        :param name: str, key of layers
+        :param geometry: shapely geometry or array of geometries, in self.crs
+        :param predicate: str, any predicate supported by geopandas sindex.query
+        :return: numpy array of positions, or a 2 x n array of (input, layer) positions for array input
+        """
+        return self.load(name).sindex.query(geometry, predicate=predicate, **kwargs)
@@ -0,0 +1,267 @@
+"""
+spatial interpolation of daily sensor measurements to geographies (census tracts, block groups, ...)
+
+this is the kriging from the spatial avg air quality notebook, but instead of kriging every point of a grid
+and then averaging the points within each tract, it kriges the tract averages directly (block kriging)
+that gives the variance of each tract average, and the covariance between tracts, not just the estimate
+
+the covariance between two tract averages is the mean covariance over all pairs of grid points in the two tracts
+that only depends on the distribution of distances between those points, which doesn't change from day to day
+so BlockSupport bins those distances once (interpolated between distance nodes half a grid cell apart),
+and each day's covariances are a sparse matrix product with the day's covariance function at the nodes
+covariances between sensors and tracts use the exact distances from each sensor to each grid point,
+to be consistent with the exact covariances between sensors (otherwise the error covariance isn't
+positive semi-definite)
+"""
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from pykrige.ok import OrdinaryKriging
+from scipy import sparse
+
+from air_brain.util.cache import cached
+from air_brain.util.geom import layers
+from air_brain.util.loc import CRS, geoms
+
+# pykrige variogram models that level off at a sill, so that they imply a covariance function
+# (linear and power grow without bound)
+bounded_models = ["gaussian", "spherical", "exponential"]
+
+
+def county_grid(cell_size=1000):
+    """
+    equally spaced points within Allegheny County
+
+    :param cell_size: float, spacing in units of CRS (feet)
+    :return: numpy array of shape (n, 2) of x, y in CRS
+    """
+    bounds = geoms.load("county").total_bounds
+    xx, yy = np.meshgrid(np.arange(bounds[0], bounds[2], cell_size),
+                         np.arange(bounds[1], bounds[3], cell_size))
+    points = gpd.points_from_xy(xx.ravel(), yy.ravel(), crs=CRS)
+    inside = np.unique(geoms.query("county", points)[0])
+    return np.column_stack([xx.ravel()[inside], yy.ravel()[inside]])
+
+
+def _node_weights(dist, bin_width):
+    """
+    cubic interpolation weights of each distance on the four surrounding distance nodes
+    slot 0 is reserved for zero distance (where the covariance includes the nugget),
+    and slot k > 0 is the node at distance (k - 1) * bin_width (with slot 1 just above zero)
+    the covariance functions are smooth away from zero, so this is exact to O(bin_width ** 4),
+    which keeps the block covariances consistent with the exact point covariances
+
+    :return: numpy arrays of the slots and the weights, each of shape (4,) + dist.shape
+    """
+    x = dist / bin_width
+    # first of the four nodes, one below the interval x is in, but never below the node just above zero
+    start = np.maximum(np.floor(x).astype(np.int64) - 1, 0)
+    t = x - start
+    weights = np.stack([-(t - 1) * (t - 2) * (t - 3) / 6,
+                        t * (t - 2) * (t - 3) / 2,
+                        -t * (t - 1) * (t - 3) / 2,
+                        t * (t - 1) * (t - 2) / 6])
+    slots = start + 1 + np.arange(4).reshape((4,) + (1,) * dist.ndim)
+    zero = dist == 0
+    slots[:, zero] = 0
+    weights[:, zero] = [[1], [0], [0], [0]]
+    return slots, weights
+
+
+# only this module's code is part of the cache key, so bump version when the results change because of
+# code elsewhere, e.g. how air_brain.util.geom builds and casts a layer
+@cached(files=lambda layer, cell_size, bin_width: [layers["county"]["file"], layers[layer]["file"]], version=1)
+def _support(layer, cell_size, bin_width):
+    """
+    grid points in each geography of layer, and the histograms of distances between geographies
+    see BlockSupport
+    """
+    geo = geoms.load(layer)
+    xy = county_grid(cell_size)
+    points = gpd.points_from_xy(xy[:, 0], xy[:, 1], crs=CRS)
+    pt_idx, geo_idx = geoms.query(layer, points, predicate="within")
+    # points on a boundary go to the first geography found
+    pt_idx, first = np.unique(pt_idx, return_index=True)
+    xy, point_geo = xy[pt_idx], geo_idx[first]
+    # geographies smaller than a grid cell get their centroid
+    empty = np.setdiff1d(np.arange(len(geo)), point_geo)
+    if len(empty):
+        centroids = geo.geometry.iloc[empty].centroid
+        xy = np.concatenate([xy, np.column_stack([centroids.x, centroids.y])])
+        point_geo = np.concatenate([point_geo, empty])
+    order = np.argsort(point_geo, kind="stable")
+    xy, point_geo = xy[order], point_geo[order]
+
+    n_geo = len(geo)
+    counts = np.bincount(point_geo, minlength=n_geo)
+    span = np.ptp(xy, axis=0)
+    n_slots = int(np.hypot(*span) // bin_width) + 5
+    rows = []
+    splits = np.cumsum(counts)[:-1]
+    for i, xy_i in enumerate(np.split(xy, splits)):
+        dist = np.hypot(xy_i[:, None, 0] - xy[None, :, 0], xy_i[:, None, 1] - xy[None, :, 1])
+        slots, weights = _node_weights(dist, bin_width)
+        flat = point_geo[None, None, :] * n_slots + slots
+        hist = np.bincount(flat.ravel(), weights=weights.ravel(), minlength=n_geo * n_slots)
+        hist = hist.reshape(n_geo, n_slots) / (counts[i] * counts[:, None])
+        rows.append(sparse.csr_matrix(hist))
+    return {"ids": geoms.ids(layer).to_numpy(),
+            "xy": xy,
+            "point_geo": point_geo,
+            "pair_hist": sparse.vstack(rows, format="csr")}
+
+
+class BlockSupport:
+    """
+    discretization of a geometry layer for block kriging
+    - grid points within each geography
+    - for each pair of geographies, the fraction of point pairs at each distance (pair_hist),
+      interpolated between distance nodes bin_width apart
+    built once per layer and cell size, and cached on disk
+    """
+    def __init__(self, layer="tract_2010", cell_size=1000, bin_width=None):
+        """
+        :param layer: str, geometry layer, see air_brain.util.geom.layers
+        :param cell_size: float, grid spacing used to discretize each geography, in feet
+        :param bin_width: optional float, spacing of the distance nodes, in feet, half of cell_size by default
+        """
+        self.layer = layer
+        self.bin_width = cell_size / 2 if bin_width is None else bin_width
+        support = _support(layer, cell_size, self.bin_width)
+        self.ids = pd.Index(support["ids"], name="ID")
+        self.xy = support["xy"]
+        self.point_geo = support["point_geo"]
+        # sparse (geography * geography, distance slot)
+        self.pair_hist = support["pair_hist"]
+        self.counts = np.bincount(self.point_geo, minlength=len(self.ids))
+        # sparse (geography, point), averaging the points in each geography
+        self.averaging = sparse.csr_matrix((1 / self.counts[self.point_geo],
+                                            (self.point_geo, np.arange(len(self.point_geo)))),
+                                           shape=(len(self.ids), len(self.point_geo)))
+
+    @property
+    def bin_centers(self):
+        """
+        distance of each slot of pair_hist: zero, then nodes bin_width apart starting just above zero
+        """
+        nodes = np.arange(self.pair_hist.shape[1] - 1) * self.bin_width
+        nodes[0] = 1e-9 * self.bin_width
+        return np.concatenate([[0], nodes])
+
+    def block_covariance(self, covariance):
+        """
+        covariance between every pair of geography averages
+
+        :param covariance: function of distance, e.g. Variogram.covariance
+        :return: numpy array of shape (geography, geography)
+        """
+        n_geo = len(self.ids)
+        ret = (self.pair_hist @ covariance(self.bin_centers)).reshape(n_geo, n_geo)
+        return (ret + ret.T) / 2
+
+    def point_covariance(self, xy, covariance):
+        """
+        covariance between each point in xy (e.g. sensors) and each geography average,
+        from the exact distances to the grid points
+
+        :param xy: numpy array of shape (n, 2)
+        :param covariance: function of distance, e.g. Variogram.covariance
+        :return: numpy array of shape (n, geography)
+        """
+        dist = np.hypot(xy[:, None, 0] - self.xy[None, :, 0], xy[:, None, 1] - self.xy[None, :, 1])
+        return (self.averaging @ covariance(dist).T).T
+
+
+def check_variogram_model(variogram_model):
+    """
+    raise ValueError unless variogram_model is one of bounded_models
+    """
+    if variogram_model not in bounded_models:
+        raise ValueError("variogram model {} has no sill, use one of {}".format(
+            variogram_model, ", ".join(bounded_models)))
+
+
+class Variogram:
+    """
+    variogram fit by pykrige to one day's measurements, and the covariance function it implies
+    """
+    def __init__(self, xy, values, variogram_model="gaussian"):
+        check_variogram_model(variogram_model)
+        ok = OrdinaryKriging(xy[:, 0], xy[:, 1], values,
+                             variogram_model=variogram_model,
+                             verbose=False,
+                             enable_plotting=False)
+        self.function = ok.variogram_function
+        self.parameters = ok.variogram_model_parameters
+        # the variogram levels off at the sill, far beyond the range
+        self.sill = float(self.function(self.parameters, np.array([1e12]))[0])
+
+    def gamma(self, dist):
+        dist = np.asarray(dist, dtype=float)
+        return np.where(dist == 0, 0, self.function(self.parameters, dist))
+
+    def covariance(self, dist):
+        return self.sill - self.gamma(dist)
+
+
+def block_krige(xy, values, support, variogram_model="gaussian"):
+    """
+    ordinary block kriging of one day's point measurements to the geographies of support
+
+    :param xy: numpy array of shape (sensor, 2), sensor locations in CRS
+    :param values: numpy array of shape (sensor,), measurements
+    :param support: BlockSupport
+    :param variogram_model: str, one of bounded_models
+    :return:
+    - numpy array of shape (geography,), estimated average over each geography
+    - numpy array of shape (geography, geography), covariance of the estimation errors
+    """
+    variogram = Variogram(xy, values, variogram_model)
+    n = len(values)
+
+    # ordinary kriging system, with the unbiasedness constraint
+    k = np.ones((n + 1, n + 1))
+    k[:n, :n] = variogram.covariance(np.hypot(xy[:, None, 0] - xy[None, :, 0], xy[:, None, 1] - xy[None, :, 1]))
+    k[n, n] = 0
+    rhs = np.ones((n + 1, len(support.ids)))
+    rhs[:n] = support.point_covariance(xy, variogram.covariance)
+    weights = np.linalg.solve(k, rhs)
+
+    mean = weights[:n].T @ values
+    cov = support.block_covariance(variogram.covariance) - rhs.T @ weights
+    return mean, cov
+
+
+def day_measurements(air, air_df=None):
+    """
+    each day's measurements for a DailyAir instance, as arrays ready for block_krige
+
+    :param air: DailyAir instance, e.g. PM25()
+    :param air_df: optional DataFrame as from air.daily_air(), e.g. only some days
+    :return: dict of pd.datetime -> (xy, values)
+    """
+    df = air.daily_air_gdf(air_df)
+    df = df.loc[df.geometry.notna() & df.index_value.notna()].to_crs(CRS)
+    xy = np.column_stack([df.geometry.x, df.geometry.y])
+    values = df.index_value.to_numpy(dtype=float)
+    return {date: (xy[pos], values[pos]) for date, pos in df.groupby("date").indices.items()}
+
+
+def daily_estimates(air, support, start=None, end=None, min_sites=3, variogram_model="gaussian"):
+    """
+    block kriging estimate for every day and geography
+
+    :param air: DailyAir instance, e.g. PM25()
+    :param support: BlockSupport
+    :param start: optional first date
+    :param end: optional last date
+    :param min_sites: int, days with fewer reporting sites are left NaN
+    :return: pandas DataFrame, indexed on date, with one column for each geography ID
+    """
+    days = day_measurements(air)
+    dates = pd.date_range(start or min(days), end or max(days), freq="D")
+    ret = np.full((len(dates), len(support.ids)), np.nan)
+    for i, date in enumerate(dates):
+        if date in days and len(days[date][1]) >= min_sites:
+            ret[i], _ = block_krige(*days[date], support, variogram_model)
+    return pd.DataFrame(ret, index=pd.Index(dates, name="date"), columns=support.ids)
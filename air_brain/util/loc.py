@@ -9,32 +9,52 @@ from math import cos, asin, sqrt, pi
 import pandas as pd
 import geopandas as gpd
 
-from air_brain.config import data_dir
+from air_brain.util.cache import cached
+from air_brain.util.geom import GeomRegistry, layers
 
 # canonical CRS for this project
 # TODO... is this the best one?
 CRS = "EPSG:2272"
 
-# geometry files
-BG_FILE = os.path.join(data_dir, "tl_2010_42003_bg10", "tl_2010_42003_bg10.shp")
-ZIP_FILE = os.path.join(data_dir, "zipcodes.geojson")
+# all geometry layers, already projected to CRS
+geoms = GeomRegistry(CRS)
 
+@cached(files=[layers["bg_2010"]["file"], layers["zip"]["file"]], version=1)
 def zip_by_bg():
     """
     generate a dataframe of the area of each zipcode intersected with each census block group
     """
     # census block groups
-    bg = gpd.read_file(BG_FILE)[["GEOID10", "geometry"]].rename(columns={"GEOID10": "ID"})
-    bg.ID = bg.ID.astype(int)
-    bg = bg.to_crs(CRS)
+    bg = geoms.load("bg_2010")[["ID", "geometry"]]
     # zip codes
-    zc = gpd.read_file(ZIP_FILE)[["ZIP", "geometry"]]
-    zc = zc.to_crs(CRS)
+    zc = geoms.load("zip")[["ZIP", "geometry"]]
     # overlap
     df = gpd.overlay(zc, bg, how="intersection")
     df["int_area"] = df["geometry"].area
     return df[["ZIP", "ID", "int_area"]]
 
+# only this module's code is part of the cache key, so bump version when the results change because of
+# code elsewhere, e.g. how air_brain.util.geom builds and casts a layer
+@cached(files=lambda src, dst: [layers[src]["file"], layers[dst]["file"]], version=1)
+def crosswalk(src, dst):
+    """
+    generate a dataframe of the share of the area of each geography in layer src that falls in each geography in layer dst
+    e.g. to move counts from block groups to zip codes, allocating each block group's count by area
+
+    :param src: str, key of air_brain.util.geom.layers
+    :param dst: str, key of air_brain.util.geom.layers
+    :return:
+    pandas DataFrame with columns
+    - src: ID in layer src
+    - dst: ID in layer dst
+    - weight: share of the area of src in dst, sums to 1 for each src unless some of src is outside every dst
+    """
+    src_df = geoms.load(src)[[layers[src]["id"], "geometry"]].rename(columns={layers[src]["id"]: "src"})
+    dst_df = geoms.load(dst)[[layers[dst]["id"], "geometry"]].rename(columns={layers[dst]["id"]: "dst"})
+    df = gpd.overlay(src_df, dst_df, how="intersection", keep_geom_type=True)
+    df["weight"] = df.geometry.area / df.src.map(src_df.geometry.area.groupby(src_df.src).sum())
+    return df.groupby(["src", "dst"], as_index=False).weight.sum()
+
 def bg2zip(df_in, cols, bg_col="ID"):
     """
     given a df_in with columns
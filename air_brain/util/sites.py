@@ -0,0 +1,265 @@
+"""
+registry of which air quality sensor sites were reporting when
+
+built in one pass over the daily AQI data, it records for each (site, parameter)
+- the intervals of consecutive days with a measurement
+- where the site is, if we know
+- which raw site names were merged into it (see DailyAir.site_aliases)
+
+and precomputes the days on which the set of reporting sites changes,
+so that "who was reporting on day d" is a binary search instead of a scan
+"""
+import numpy as np
+import pandas as pd
+
+
+def _days(dates):
+    """
+    convert datetimes to integer days since the epoch
+    """
+    return pd.to_datetime(pd.Series(dates)).values.astype("datetime64[D]").astype(np.int64)
+
+
+def _runs(keys, days):
+    """
+    given rows sorted by (keys, days), find runs of consecutive days within each key
+
+    :param keys: numpy array of integer key codes
+    :param days: numpy array of integer days
+    :return: positions of the first and last row of each run
+    """
+    if len(days) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    new_run = np.ones(len(days), dtype=bool)
+    new_run[1:] = (keys[1:] != keys[:-1]) | (np.diff(days) != 1)
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:] - 1, len(days) - 1)
+    return starts, ends
+
+
+class Intervals:
+    """
+    sorted, non-overlapping intervals of days [start, end] (inclusive) for one site
+    with a running total of covered days, so coverage between any two days is a pair of bisections
+    """
+    def __init__(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.cum_days = np.concatenate([[0], np.cumsum(self.ends - self.starts + 1)])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, day):
+        """
+        True if day falls in one of the intervals
+        """
+        i = np.searchsorted(self.starts, day, side="right") - 1
+        return i >= 0 and day <= self.ends[i]
+
+    def covered_days(self, first, last):
+        """
+        number of days in [first, last] covered by the intervals
+        """
+        if last < first:
+            return 0
+        i = np.searchsorted(self.ends, first, side="left")
+        j = np.searchsorted(self.starts, last, side="right")
+        if i >= j:
+            return 0
+        total = self.cum_days[j] - self.cum_days[i]
+        # clip the partial intervals at either end
+        total -= max(0, first - self.starts[i])
+        total -= max(0, self.ends[j - 1] - last)
+        return int(total)
+
+    def gaps(self):
+        """
+        intervals of days between the first and last reported day with no measurement
+        """
+        return Intervals(self.ends[:-1] + 1, self.starts[1:] - 1)
+
+
+class SiteRegistry:
+    """
+    site / parameter coverage for daily air quality data
+
+    days are integers (days since the epoch) internally, and pandas Timestamps at the interface
+    """
+    def __init__(self, daily_df, site_loc=None, aliases=None):
+        """
+        :param daily_df: pandas DataFrame of daily AQI in long format, as from DailyAir.daily_air()
+        :param site_loc: optional geopandas GeoDataFrame with columns site and geometry
+        :param aliases: optional dict of raw site name -> site name it was merged into
+        """
+        self.aliases = dict() if aliases is None else dict(aliases)
+        if site_loc is None:
+            self.locations = dict()
+        else:
+            located = site_loc.loc[site_loc.geometry.notna()]
+            self.locations = dict(zip(located.site, located.geometry))
+
+        df = daily_df.loc[daily_df.index_value.notna(), ["site", "parameter", "date"]]
+        site_codes, self.sites = pd.factorize(df.site, sort=True)
+        param_codes, self.parameters = pd.factorize(df.parameter, sort=True)
+        days = _days(df.date)
+
+        # one pass: sort by (site, parameter, day) and split into runs of consecutive days
+        keys = site_codes.astype(np.int64) * len(self.parameters) + param_codes
+        order = np.lexsort((days, keys))
+        keys, days = keys[order], days[order]
+        keep = np.ones(len(days), dtype=bool)
+        keep[1:] = (keys[1:] != keys[:-1]) | (days[1:] != days[:-1])
+        keys, days = keys[keep], days[keep]
+        starts, ends = _runs(keys, days)
+
+        self.intervals = dict()
+        run_keys = keys[starts]
+        bounds = np.flatnonzero(np.diff(run_keys)) + 1
+        for grp in np.split(np.arange(len(starts)), bounds):
+            if len(grp) == 0:
+                continue
+            site, param = divmod(int(run_keys[grp[0]]), len(self.parameters))
+            self.intervals[(self.sites[site], self.parameters[param])] = \
+                Intervals(days[starts[grp]], days[ends[grp]])
+
+        self._changes = dict()
+
+    @classmethod
+    def from_daily_air(cls, air):
+        """
+        build the registry for a DailyAir instance, e.g. PM25()
+        """
+        return cls(air.daily_air(), air.all_site_loc(), getattr(air, "site_aliases", None))
+
+    def _parameters(self, parameters):
+        if parameters is None:
+            return tuple(self.parameters)
+        if isinstance(parameters, str):
+            return (parameters,)
+        return tuple(sorted(parameters))
+
+    def site_intervals(self, site, parameters=None):
+        """
+        intervals during which site reported any of parameters (all parameters by default)
+        """
+        parameters = self._parameters(parameters)
+        found = [self.intervals[(site, p)] for p in parameters if (site, p) in self.intervals]
+        if len(found) == 0:
+            return Intervals([], [])
+        if len(found) == 1:
+            return found[0]
+        starts = np.concatenate([i.starts for i in found])
+        ends = np.concatenate([i.ends for i in found])
+        # merge overlapping or touching intervals across parameters
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+        running_end = np.maximum.accumulate(ends)
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = starts[1:] > running_end[:-1] + 1
+        first = np.flatnonzero(new)
+        last = np.append(first[1:] - 1, len(starts) - 1)
+        return Intervals(starts[first], running_end[last])
+
+    def _change_points(self, parameters=None):
+        """
+        days on which the reporting set changes, and the set of sites reporting from each of those days
+        memoized per set of parameters
+        """
+        parameters = self._parameters(parameters)
+        if parameters not in self._changes:
+            events = dict()
+            for site in self.sites:
+                ivs = self.site_intervals(site, parameters)
+                for start, end in zip(ivs.starts, ivs.ends):
+                    events.setdefault(int(start), []).append((site, True))
+                    events.setdefault(int(end) + 1, []).append((site, False))
+            days = sorted(events)
+            sets = []
+            current = set()
+            for day in days:
+                for site, on in events[day]:
+                    if on:
+                        current.add(site)
+                    else:
+                        current.discard(site)
+                sets.append(frozenset(current))
+            self._changes[parameters] = (np.array(days, dtype=np.int64), sets)
+        return self._changes[parameters]
+
+    def reporting(self, date, parameters=None):
+        """
+        sites reporting any of parameters on date
+
+        :return: frozenset of site names
+        """
+        days, sets = self._change_points(parameters)
+        i = np.searchsorted(days, _days([date])[0], side="right") - 1
+        return sets[i] if i >= 0 else frozenset()
+
+    def changes(self, parameters=None):
+        """
+        dates on which the set of sites reporting any of parameters changed
+
+        :return: pandas DatetimeIndex
+        """
+        days, _ = self._change_points(parameters)
+        return pd.to_datetime(days.astype("datetime64[D]"))
+
+    def reporting_groups(self, parameters=None):
+        """
+        consecutive runs of days with the same reporting set, e.g. to fit one interpolation per run
+
+        :return: pandas DataFrame with columns
+        - start : pd.datetime
+        - end : pd.datetime, inclusive
+        - sites : frozenset of site names
+        """
+        days, sets = self._change_points(parameters)
+        df = pd.DataFrame({"start": pd.to_datetime(days[:-1].astype("datetime64[D]")),
+                           "end": pd.to_datetime((days[1:] - 1).astype("datetime64[D]")),
+                           "sites": sets[:-1]})
+        return df.loc[df.sites.apply(len) > 0].reset_index(drop=True)
+
+    def coverage(self, site, start, end, parameters=None):
+        """
+        fraction of days in [start, end] on which site reported any of parameters
+        """
+        first, last = _days([start, end])
+        return self.site_intervals(site, parameters).covered_days(first, last) / (last - first + 1)
+
+    def coverage_by_year(self, parameters=None):
+        """
+        fraction of days in each calendar year on which each site reported any of parameters
+
+        :return: pandas DataFrame, indexed on year, with one column for each site
+        """
+        days, _ = self._change_points(parameters)
+        if len(days) == 0:
+            return pd.DataFrame()
+        # the last change point is the day after the last interval ends
+        years = range(pd.Timestamp(days[0].astype("datetime64[D]")).year,
+                      pd.Timestamp((days[-1] - 1).astype("datetime64[D]")).year + 1)
+        ret = dict()
+        for site in self.sites:
+            ret[site] = [self.coverage(site, "{}-01-01".format(year), "{}-12-31".format(year), parameters)
+                         for year in years]
+        return pd.DataFrame(ret, index=pd.Index(years, name="year"))
+
+    def gaps(self, site, parameters=None):
+        """
+        periods with no measurement between the first and last day site reported
+
+        :return: pandas DataFrame with columns start and end (inclusive)
+        """
+        gaps = self.site_intervals(site, parameters).gaps()
+        return pd.DataFrame({"start": pd.to_datetime(gaps.starts.astype("datetime64[D]")),
+                             "end": pd.to_datetime(gaps.ends.astype("datetime64[D]"))})
+
+    def missing_locations(self, parameters=None):
+        """
+        sites with measurements for any of parameters but no location information
+        """
+        parameters = self._parameters(parameters)
+        sites = {site for site, param in self.intervals if param in parameters}
+        return sorted(sites - set(self.locations))
@@ -0,0 +1,158 @@
+"""
+exposure to air toxics from facility releases (EPA Toxics Release Inventory, via WPRDC air_toxic_releases)
+
+for each geography (block group or tract) centroid, sum the air releases of every facility within a cutoff,
+weighted by a decay function of distance, for each year and chemical
+facilities beyond the cutoff are pruned with a spatial index before computing any distances,
+and the sums for every year and chemical are one sparse matrix product
+(geography x facility weights) @ (facility x (year, chemical) releases)
+
+output is keyed on the same ID as the AbcEJ block group / tract files, so it joins the regression tables directly
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy import sparse
+
+from air_brain.config import data_dir
+from air_brain.util.cache import cached
+from air_brain.util.geom import layers
+from air_brain.util.loc import CRS, geoms
+
+TOXICS_FILE = os.path.join(data_dir, "air_toxic_releases.csv")
+
+# possible names of each column we use, after lower casing and dropping TRI's "NN. " column number prefixes
+# these follow the EPA TRI basic data files, which the WPRDC dump is taken from
+# releases() lists the columns it found if a name is missing, so add it here
+column_names = {"year": ["year", "reporting_year"],
+                "facility": ["tri_facility_id", "trifd", "trifid"],
+                "latitude": ["latitude"],
+                "longitude": ["longitude"],
+                "chemical": ["chemical", "chemical_name"],
+                "total_air": ["total_air", "total_air_emissions"],
+                "fugitive_air": ["fugitive_air", "5.1_fugitive_air"],
+                "stack_air": ["stack_air", "5.2_stack_air"],
+                }
+
+# decay of exposure with distance (in feet) from a facility, relative to a length scale (in feet)
+decay_functions = {"exponential": lambda d, scale: np.exp(-d / scale),
+                   "inverse_square": lambda d, scale: 1 / (1 + (d / scale) ** 2),
+                   "none": lambda d, scale: np.ones_like(d),
+                   }
+
+
+def _normalize(col):
+    col = col.strip().lower()
+    # e.g. "47. 5.1 - FUGITIVE AIR" -> "5.1_fugitive_air"
+    if ". " in col and col.split(". ", 1)[0].isdigit():
+        col = col.split(". ", 1)[1]
+    return col.replace(" - ", "_").replace(" ", "_")
+
+
+def releases(filename=TOXICS_FILE):
+    """
+    air releases of each chemical by each facility and year
+
+    :return:
+    geopandas GeoDataFrame with columns
+    - facility : str
+    - year : int
+    - chemical : str
+    - air : float, pounds released to air (fugitive + stack)
+    - geometry : facility location in CRS
+    """
+    df = pd.read_csv(filename, low_memory=False)
+    df.columns = [_normalize(col) for col in df.columns]
+    rename = dict()
+    for name, candidates in column_names.items():
+        found = [col for col in candidates if col in df.columns]
+        if found:
+            rename[found[0]] = name
+    df = df.rename(columns=rename)
+    for col in ["year", "facility", "latitude", "longitude", "chemical"]:
+        assert col in df.columns, "none of {} in {}, which has columns {}".format(
+            ", ".join(column_names[col]), filename, ", ".join(df.columns))
+    if "total_air" in df.columns:
+        df["air"] = pd.to_numeric(df.total_air, errors="coerce")
+    else:
+        assert "fugitive_air" in df.columns and "stack_air" in df.columns, \
+            "no air release columns in {}, which has columns {}".format(filename, ", ".join(df.columns))
+        df["air"] = pd.to_numeric(df.fugitive_air, errors="coerce").fillna(0) \
+            + pd.to_numeric(df.stack_air, errors="coerce").fillna(0)
+    df = df.loc[df.latitude.notna() & df.longitude.notna() & (df.air > 0)]
+    df = df.groupby(["facility", "year", "chemical"]).agg({"air": "sum", "latitude": "first", "longitude": "first"})
+    df = df.reset_index()
+    gdf = gpd.GeoDataFrame(df.drop(columns=["latitude", "longitude"]),
+                           geometry=gpd.points_from_xy(df.longitude, df.latitude),
+                           crs="EPSG:4326")
+    return gdf.to_crs(CRS)
+
+
+def distance_weights(facilities, layer="tract_2010", cutoff=5 * 5280, decay="exponential", scale=5280):
+    """
+    sparse weights from each facility to each geography centroid within cutoff
+
+    :param facilities: geopandas GeoSeries of facility points in CRS
+    :param layer: str, see air_brain.util.geom.layers
+    :param cutoff: float, feet beyond which a facility contributes nothing
+    :param decay: str, key of decay_functions
+    :param scale: float, length scale of the decay, in feet
+    :return: scipy sparse csr matrix of shape (geography, facility)
+    """
+    centroids = geoms.load(layer).geometry.centroid
+    # pairs within the cutoff, from the spatial index
+    fac_idx, geo_idx = centroids.sindex.query(facilities.values, predicate="dwithin", distance=cutoff)
+    dist = np.hypot(centroids.x.to_numpy()[geo_idx] - facilities.x.to_numpy()[fac_idx],
+                    centroids.y.to_numpy()[geo_idx] - facilities.y.to_numpy()[fac_idx])
+    weights = decay_functions[decay](dist, scale)
+    return sparse.csr_matrix((weights, (geo_idx, fac_idx)), shape=(len(centroids), len(facilities)))
+
+
+# only this module's code is part of the cache key, so bump version when the results change because of
+# code elsewhere, e.g. how air_brain.util.geom builds and casts a layer
+@cached(files=lambda layer, filename, **kwargs: [filename, layers[layer]["file"]], version=1)
+def toxic_exposure(layer="tract_2010", filename=TOXICS_FILE, cutoff=5 * 5280, decay="exponential", scale=5280):
+    """
+    distance weighted sum of facility air releases for each geography, year and chemical
+
+    :param layer: str, tract_2010 or bg_2010 (or any layer, see air_brain.util.geom.layers)
+    :param filename: str, air toxic releases csv downloaded from WPRDC
+    :param cutoff: float, feet beyond which a facility contributes nothing
+    :param decay: str, key of decay_functions
+    :param scale: float, length scale of the decay, in feet
+    :return:
+    pandas DataFrame with columns
+    - ID : geography ID, as in the AbcEJ files
+    - year : int
+    - chemical : str
+    - exposure : float, weighted pounds released to air
+    only non-zero exposures are included
+    """
+    rel = releases(filename)
+    fac_codes, fac_index = pd.factorize(rel.facility)
+    col_codes, col_index = pd.factorize(pd.MultiIndex.from_arrays([rel.year, rel.chemical]))
+    # (facility, (year, chemical)) release matrix
+    release_matrix = sparse.csr_matrix((rel.air.to_numpy(), (fac_codes, col_codes)),
+                                       shape=(len(fac_index), len(col_index)))
+    facilities = rel.geometry.groupby(fac_codes).first()
+
+    weights = distance_weights(gpd.GeoSeries(facilities.values, crs=CRS), layer, cutoff, decay, scale)
+    exposure = (weights @ release_matrix).tocoo()
+
+    ids = geoms.ids(layer).to_numpy()
+    return pd.DataFrame({"ID": ids[exposure.row],
+                         "year": col_index.get_level_values(0)[exposure.col],
+                         "chemical": col_index.get_level_values(1)[exposure.col],
+                         "exposure": exposure.data})
+
+
+def exposure_by_chemical(df, year):
+    """
+    one year of toxic_exposure output with one column per chemical, ready to merge on ID with AbcEJ files
+    geographies with no facility within the cutoff are left out, so fill with 0 after merging
+    """
+    sub = df.loc[df.year == year]
+    wide = sub.pivot(index="ID", columns="chemical", values="exposure").fillna(0)
+    return wide.rename_axis(columns=None).reset_index()
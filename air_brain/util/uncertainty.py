@@ -0,0 +1,174 @@
+"""
+propagate the uncertainty of the daily interpolation through to tract (or other geography) exposures
+
+kriging gives each day's geography averages as a multivariate normal: the estimate and the error covariance
+(see air_brain.util.interp.block_krige), which the notebooks were throwing away
+here we draw many spatially correlated realizations of each day at once (one Cholesky factor per day,
+then one matrix product for all realizations), and accumulate them into period averages,
+so the result is a distribution of exposures for each geography, not a single number
+
+days are independent draws, i.e. this ignores correlation of the errors from one day to the next
+"""
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from air_brain.util.interp import BlockSupport, block_krige, check_variogram_model, day_measurements
+
+# share of the total variance that may be lost to clipping negative eigenvalues before warning
+CLIP_TOLERANCE = 1e-3
+
+# set in each worker process, so the (large) support is only sent once per process
+_worker_support = None
+
+
+def _init_worker(support):
+    global _worker_support
+    _worker_support = support
+
+
+def _cholesky(cov):
+    """
+    lower triangular factor of a covariance matrix, adding jitter to the diagonal if it is not numerically
+    positive definite
+    """
+    cov = (cov + cov.T) / 2
+    jitter = 1e-10 * max(np.trace(cov) / len(cov), 1e-12)
+    # up to 1e-6 of the mean variance, anything more is a real error that shouldn't be hidden
+    for _ in range(5):
+        try:
+            return np.linalg.cholesky(cov + jitter * np.eye(len(cov)))
+        except np.linalg.LinAlgError:
+            jitter *= 10
+    # fall back to clipping negative eigenvalues
+    vals, vecs = np.linalg.eigh(cov)
+    clipped = -vals[vals < 0].sum()
+    if clipped > CLIP_TOLERANCE * np.abs(vals).sum():
+        warnings.warn("covariance is not positive semi-definite, clipping negative eigenvalues "
+                      "drops {:.2%} of the variance".format(clipped / np.abs(vals).sum()))
+    return vecs * np.sqrt(np.clip(vals, 0, None))
+
+
+def simulate_day(mean, cov, n_realizations, rng):
+    """
+    draw realizations of one day's geography averages
+
+    :param mean: numpy array of shape (geography,)
+    :param cov: numpy array of shape (geography, geography)
+    :param n_realizations: int
+    :param rng: numpy Generator
+    :return: numpy array of shape (geography, realization)
+    """
+    noise = rng.standard_normal((len(mean), n_realizations))
+    return mean[:, None] + _cholesky(cov) @ noise
+
+
+def _simulate_days(days, n_realizations, variogram_model, support=None):
+    """
+    sum of realizations over days
+
+    :param days: list of (xy, values, SeedSequence), one per day
+    :return: numpy array of shape (geography, realization), and the number of days simulated
+    """
+    support = _worker_support if support is None else support
+    total = np.zeros((len(support.ids), n_realizations))
+    for xy, values, seed in days:
+        mean, cov = block_krige(xy, values, support, variogram_model)
+        total += simulate_day(mean, cov, n_realizations, np.random.default_rng(seed))
+    return total, len(days)
+
+
+class ExposureDistribution:
+    """
+    realizations of the average exposure over a period for each geography
+    """
+    def __init__(self, samples, n_days):
+        """
+        :param samples: pandas DataFrame, indexed on geography ID, with one column per realization
+        :param n_days: int, number of days that went into each average
+        """
+        self.samples = samples
+        self.n_days = n_days
+
+    def mean(self):
+        return self.samples.mean(axis=1)
+
+    def std(self):
+        return self.samples.std(axis=1)
+
+    def quantiles(self, q=(0.025, 0.5, 0.975)):
+        """
+        :return: pandas DataFrame, indexed on geography ID, with one column per quantile
+        """
+        return pd.DataFrame(np.quantile(self.samples.to_numpy(), q, axis=1).T,
+                            index=self.samples.index,
+                            columns=pd.Index(q, name="quantile"))
+
+    def summary(self):
+        """
+        :return: pandas DataFrame with columns ID, mean, std, and the 2.5%, 50% and 97.5% quantiles,
+            e.g. to join to a 2017_tract.csv style file
+        """
+        df = self.quantiles()
+        df.columns = ["q{:g}".format(100 * q) for q in df.columns]
+        df.insert(0, "std", self.std())
+        df.insert(0, "mean", self.mean())
+        return df.reset_index()
+
+
+def simulate_exposure(air, start, end,
+                      layer="tract_2010",
+                      n_realizations=1000,
+                      seed=0,
+                      n_jobs=None,
+                      min_sites=3,
+                      variogram_model="gaussian",
+                      cell_size=1000):
+    """
+    distribution of the average exposure over [start, end] for each geography of layer
+
+    each day gets its own seed, spawned from seed, so results don't depend on n_jobs
+    (up to floating point summation order)
+
+    :param air: DailyAir instance, e.g. PM25()
+    :param start: first date
+    :param end: last date, inclusive
+    :param layer: str, geometry layer to average over, see air_brain.util.geom.layers
+    :param n_realizations: int
+    :param seed: int
+    :param n_jobs: optional int, number of processes (defaults to the number of CPUs)
+    :param min_sites: int, days with fewer reporting sites are skipped
+    :param variogram_model: str, one of air_brain.util.interp.bounded_models
+    :param cell_size: float, grid spacing used to discretize each geography, in feet
+    :return: ExposureDistribution
+    """
+    check_variogram_model(variogram_model)
+    support = BlockSupport(layer, cell_size)
+    measurements = day_measurements(air)
+    dates = [date for date in pd.date_range(start, end, freq="D")
+             if date in measurements and len(measurements[date][1]) >= min_sites]
+    seeds = np.random.SeedSequence(seed).spawn(len(dates))
+    days = [(*measurements[date], s) for date, s in zip(dates, seeds)]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(days) < 2:
+        total, n_days = _simulate_days(days, n_realizations, variogram_model, support)
+    else:
+        chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(days)), n_jobs) if len(chunk)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(support,)) as pool:
+            futures = [pool.submit(_simulate_days, [days[i] for i in chunk], n_realizations, variogram_model)
+                       for chunk in chunks]
+            total = np.zeros((len(support.ids), n_realizations))
+            n_days = 0
+            for future in futures:
+                chunk_total, chunk_days = future.result()
+                total += chunk_total
+                n_days += chunk_days
+
+    assert n_days > 0, "no days between {} and {} with at least {} sites".format(start, end, min_sites)
+    samples = pd.DataFrame(total / n_days, index=support.ids,
+                           columns=pd.RangeIndex(n_realizations, name="realization"))
+    return ExposureDistribution(samples, n_days)
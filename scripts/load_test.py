@@ -0,0 +1,121 @@
+"""
+load test for the exposure query service (air_brain.service)
+
+sends random point and tract queries and reports latency percentiles
+exits with an error if the median latency is over the target (10 ms by default)
+
+by default this starts the service in-process on a free port,
+or pass --url to test a service that is already running
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlencode, urlparse
+
+import numpy as np
+
+# rough lat/lon bounds of Allegheny County
+LAT = (40.36, 40.56)
+LON = (-80.15, -79.80)
+
+
+def make_queries(n, ids, days, seed=0, hot_fraction=0.5):
+    """
+    random mix of point and geography queries over random date ranges
+    hot_fraction of them repeat earlier queries, like a dashboard would
+    """
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in range(n):
+        if queries and rng.random() < hot_fraction:
+            queries.append(queries[rng.integers(len(queries))])
+            continue
+        start = days[rng.integers(len(days))]
+        end = min(days[-1], start + np.timedelta64(int(rng.integers(0, 60)), "D"))
+        params = {"start": str(start), "end": str(end)}
+        if rng.random() < 0.5:
+            params.update(lat=round(rng.uniform(*LAT), 5), lon=round(rng.uniform(*LON), 5))
+            queries.append("/point?" + urlencode(params))
+        else:
+            params["id"] = ids[rng.integers(len(ids))]
+            queries.append("/geography?" + urlencode(params))
+    return queries
+
+
+def run(url, queries, concurrency):
+    """
+    send queries with concurrency connections
+
+    :return: numpy array of latencies in ms, and the number of failed requests
+    """
+    parsed = urlparse(url)
+    local = threading.local()
+
+    def one(path):
+        if not hasattr(local, "conn"):
+            local.conn = HTTPConnection(parsed.hostname, parsed.port)
+        t0 = time.perf_counter()
+        local.conn.request("GET", path)
+        response = local.conn.getresponse()
+        response.read()
+        return (time.perf_counter() - t0) * 1000, response.status >= 500
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, queries))
+    latencies = np.array([r[0] for r in results])
+    return latencies, sum(r[1] for r in results)
+
+
+def start_service():
+    """
+    start the service on a free port in a background thread
+
+    :return: url of the service, and the service
+    """
+    from http.server import ThreadingHTTPServer
+    from air_brain.service import ExposureService, make_handler
+
+    print("Loading exposure data")
+    service = ExposureService()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}".format(server.server_port), service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="url of a running service, otherwise one is started")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--target-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.url is None:
+        url, service = start_service()
+        ids = [str(i) for i in service.ids]
+        days = service.days
+    else:
+        url = args.url
+        # ask the service what it has
+        conn = HTTPConnection(urlparse(url).hostname, urlparse(url).port)
+        conn.request("GET", "/point?" + urlencode({"lat": np.mean(LAT), "lon": np.mean(LON)}))
+        body = json.loads(conn.getresponse().read())
+        ids = [str(body["id"])]
+        days = np.array(body["dates"], dtype="datetime64[D]")
+
+    queries = make_queries(args.requests, ids, days)
+    # warm up connections, not the result cache
+    run(url, queries[:args.concurrency], args.concurrency)
+    latencies, failures = run(url, queries, args.concurrency)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print("{} requests, {} failed".format(len(latencies), failures))
+    print("latency ms: p50 {:.2f}, p95 {:.2f}, p99 {:.2f}, max {:.2f}".format(p50, p95, p99, latencies.max()))
+    if failures or p50 > args.target_ms:
+        print("FAIL: target p50 is {} ms".format(args.target_ms))
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,18 @@
+"""
+nightly refresh of the daily air quality data and the products derived from it
+
+re-downloads the WPRDC daily AQI file, then only processes the days appended since the last run
+see air_brain.util.daily_store
+"""
+import air_brain.data.wprdc as wprdc
+from air_brain.util.air import PM25
+from air_brain.util.daily_store import DailyStore
+
+def update_pm25():
+    store = DailyStore(PM25())
+    dates = store.update()
+    print("Processed {} days of PM 2.5".format(len(dates)))
+
+if __name__ == "__main__":
+    wprdc.download_csv("daily_air_quality")
+    update_pm25()
@@ -0,0 +1,80 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from air_brain.util import cache, geom, loc
+from air_brain.util.air import PM25
+
+# lower left corner of the synthetic county, in loc.CRS (feet), around downtown Pittsburgh
+X0, Y0 = 1340000, 410000
+# the county is a square of SIDE feet, split into a GRID x GRID layer of square geographies
+SIDE = 20000
+GRID = 4
+
+
+@pytest.fixture
+def synthetic_layers(tmp_path, monkeypatch):
+    """
+    a square county and a "squares" layer of GRID x GRID geographies with integer IDs,
+    with the geometry and result caches in tmp_path
+    """
+    step = SIDE / GRID
+    squares = [box(X0 + i * step, Y0 + j * step, X0 + (i + 1) * step, Y0 + (j + 1) * step)
+               for j in range(GRID) for i in range(GRID)]
+    gpd.GeoDataFrame({"ID": range(len(squares))}, geometry=squares, crs=loc.CRS).to_file(tmp_path / "squares.geojson")
+    gpd.GeoDataFrame({"name": ["county"]}, geometry=[box(X0, Y0, X0 + SIDE, Y0 + SIDE)],
+                     crs=loc.CRS).to_file(tmp_path / "county.geojson")
+    monkeypatch.setitem(geom.layers, "squares", {"file": tmp_path / "squares.geojson", "rename": {},
+                                                 "id": "ID", "id_type": int})
+    monkeypatch.setitem(geom.layers, "county", {"file": tmp_path / "county.geojson", "rename": {},
+                                                "id": None, "id_type": None})
+    monkeypatch.setattr(loc.geoms, "cache_dir", tmp_path / "geom_cache")
+    monkeypatch.setattr(loc.geoms, "_loaded", dict())
+    monkeypatch.setattr(cache.cache, "cache_dir", tmp_path / "cache")
+    return tmp_path
+
+
+# synthetic sensors, as (name, x, y) in loc.CRS, with one reporting under an alias with no location of its own
+SENSORS = [("Lawrenceville", X0 + 3000, Y0 + 4000),
+           ("Avalon", X0 + 16000, Y0 + 3000),
+           ("Liberty", X0 + 10000, Y0 + 17000),
+           ("North Braddock", X0 + 4000, Y0 + 15000),
+           ("Parkway East", X0 + 17000, Y0 + 12000)]
+
+
+def air_rows(start="2017-01-25", end="2017-02-05", seed=0):
+    """
+    daily air quality csv rows for the synthetic sensors, a smooth field plus noise
+    Pittsburgh reports for Lawrenceville on even days, and both report on the first day
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i, date in enumerate(pd.date_range(start, end)):
+        for site, x, y in SENSORS:
+            names = [site]
+            if site == "Lawrenceville":
+                names = ["Lawrenceville", "Pittsburgh"] if i == 0 else ["Pittsburgh" if i % 2 == 0 else site]
+            for name in names:
+                value = 30 + i + 1e-3 * (x - X0) + 5e-4 * (y - Y0) + rng.normal(0, 2)
+                rows.append({"date": date.strftime("%Y-%m-%d"), "site": name, "parameter": "PM25B",
+                             "index_value": round(value, 1), "description": "Good",
+                             "health_advisory": "", "health_effects": ""})
+        rows.append({"date": date.strftime("%Y-%m-%d"), "site": "Avalon", "parameter": "SO2",
+                     "index_value": 5, "description": "Good", "health_advisory": "", "health_effects": ""})
+    df = pd.DataFrame(rows)
+    df.insert(0, "_id", np.arange(len(df)))
+    return df
+
+
+@pytest.fixture
+def synthetic_air(synthetic_layers):
+    """
+    PM25 reading a daily air quality csv and sensor geojson in the synthetic_layers directory,
+    with the csv left for each test to write
+    """
+    gpd.GeoDataFrame({"SiteName": [name for name, _, _ in SENSORS]},
+                     geometry=gpd.points_from_xy([x for _, x, _ in SENSORS], [y for _, _, y in SENSORS]),
+                     crs=loc.CRS).to_crs("EPSG:4326").to_file(synthetic_layers / "sensor_json.geojson")
+    return PM25(data_dir=synthetic_layers)
@@ -0,0 +1,101 @@
+import os
+
+import pandas as pd
+import pytest
+
+from air_brain.util.cache import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(tmp_path / "cache", max_bytes=10 ** 6)
+
+
+def test_hit_and_miss(cache):
+    calls = []
+
+    @cache.cached()
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square(3) == 9
+    assert square(3) == 9
+    assert square(4) == 16
+    assert calls == [3, 4]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_bound_arguments_share_an_entry(cache):
+    calls = []
+
+    @cache.cached()
+    def add(x, y=1):
+        calls.append((x, y))
+        return x + y
+
+    assert add(1) == add(x=1) == add(1, 1) == add(1, y=1) == 2
+    assert calls == [(1, 1)]
+
+
+def test_files_gets_every_argument(cache, tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("a")
+
+    @cache.cached(files=lambda name, scale, offset: [source])
+    def read(name, scale=2, offset=0):
+        return source.read_text() * scale + name * offset
+
+    assert read("x", 1, 1) == "ax"
+    assert read("x") == "aa"
+    # a changed input file is a miss
+    source.write_text("bb")
+    os.utime(source, ns=(0, 0))
+    assert read("x") == "bbbb"
+
+
+def test_dataframes_round_trip(cache):
+    @cache.cached()
+    def frame(n):
+        return pd.DataFrame({"a": range(n), "b": [str(i) for i in range(n)]})
+
+    expected = frame(5)
+    assert any(name.endswith(".parquet") for name in os.listdir(cache.cache_dir))
+    pd.testing.assert_frame_equal(frame(5), expected)
+
+
+def test_eviction_is_least_recently_used(cache):
+    # room for two results but not three
+    cache.max_bytes = 2500
+
+    @cache.cached()
+    def blob(i):
+        return bytes(1000) + bytes([i])
+
+    paths = dict()
+    for i in [0, 1]:
+        before = set(os.listdir(cache.cache_dir)) if os.path.exists(cache.cache_dir) else set()
+        blob(i)
+        (paths[i],) = set(os.listdir(cache.cache_dir)) - before - {".lock"}
+    os.utime(os.path.join(cache.cache_dir, paths[0]), (100, 100))
+    os.utime(os.path.join(cache.cache_dir, paths[1]), (200, 200))
+    # a hit makes 0 the most recently used, so adding 2 evicts 1
+    blob(0)
+    blob(2)
+    assert os.path.exists(os.path.join(cache.cache_dir, paths[0]))
+    assert not os.path.exists(os.path.join(cache.cache_dir, paths[1]))
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_eviction_removes_stale_temporary_files(cache):
+    os.makedirs(cache.cache_dir)
+    stale = os.path.join(cache.cache_dir, "killed.tmp")
+    fresh = os.path.join(cache.cache_dir, "writing.tmp")
+    for path in [stale, fresh]:
+        with open(path, "wb") as f:
+            f.write(bytes(100))
+    os.utime(stale, (0, 0))
+    cache.evict()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from air_brain.data.census import ACS5
+
+# two tracts (one block group each) in each of two counties, logical record numbers from 1
+GEO = pd.DataFrame({"LOGRECNO": [1, 2, 3, 4, 5, 6, 7, 8],
+                    "county": ["003", "003", "005", "005"] * 2,
+                    "level": ["tract"] * 4 + ["bg"] * 4,
+                    "ID": [42003010100, 42003010200, 42005010100, 42005010200,
+                           420030101001, 420030102001, 420050101001, 420050102001]})
+LOOKUP = pd.DataFrame({"code": ["B1_001", "B1_002", "B2_001"], "seq": [1, 1, 2], "position": [6, 7, 6]})
+
+
+class FakeACS5(ACS5):
+    """
+    ACS5 with the lookup, geography and sequence files replaced by GEO and LOOKUP,
+    where the value of each cell is its logical record number plus its position
+    """
+    def __init__(self, save_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.save_dir = save_dir
+        self.reads = []
+
+    def lookup(self):
+        return LOOKUP
+
+    def geo(self):
+        return GEO.loc[GEO.county.isin(self.counties), ["LOGRECNO", "level", "ID"]]
+
+    def read_seq(self, seq, positions, logrecnos):
+        self.reads.append((seq, sorted(positions.values())))
+        df = pd.DataFrame({"LOGRECNO": sorted(logrecnos)})
+        for position, code in positions.items():
+            df[code] = (df.LOGRECNO + position).astype("float64")
+        return df
+
+
+def test_new_columns_are_merged_into_saved(tmp_path):
+    acs = FakeACS5(tmp_path)
+    first = acs.get_data(["B1_001"])
+    assert acs.reads == [(1, ["B1_001"])]
+    assert first["tract"].B1_001.tolist() == [7.0, 8.0]
+
+    ret = acs.get_data({"B1_001": "a", "B2_001": "b"})
+    # only the sequence with the new column is read
+    assert acs.reads == [(1, ["B1_001"]), (2, ["B2_001"])]
+    assert ret["bg"].columns.tolist() == ["ID", "a", "b"]
+    assert ret["bg"].a.tolist() == [11.0, 12.0]
+    assert ret["bg"].b.tolist() == [11.0, 12.0]
+    saved = pd.read_parquet(acs.data_file("tract"))
+    assert sorted(saved.columns) == ["B1_001", "B2_001", "ID"]
+
+    acs.get_data(["B2_001", "B1_001"])
+    assert len(acs.reads) == 2
+
+
+def test_counties_are_saved_separately(tmp_path):
+    FakeACS5(tmp_path).get_data(["B1_001"])
+    both = FakeACS5(tmp_path, counties=("003", "005"))
+    ret = both.get_data(["B1_001"])
+    assert both.reads == [(1, ["B1_001"])]
+    assert ret["tract"].ID.tolist() == [42003010100, 42003010200, 42005010100, 42005010200]
+
+
+def test_unknown_column(tmp_path):
+    with pytest.raises(AssertionError, match="B9_001"):
+        FakeACS5(tmp_path).get_data(["B9_001"])
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from air_brain.util import events
+from air_brain.util.events import EventTensor
+
+layer_ids = {"small": [10, 20, 30], "big": [1, 2]}
+
+
+@pytest.fixture(autouse=True)
+def fake_layers(monkeypatch):
+    # geography IDs without the geometry files
+    monkeypatch.setattr(events, "_layer_ids", lambda layer: pd.Index(layer_ids[layer], name="ID"))
+    # 10 is in 1, 20 is split between 1 and 2, 30 is in 2
+    monkeypatch.setattr(events, "crosswalk", lambda src, dst: pd.DataFrame(
+        {"src": [10, 20, 20, 30], "dst": [1, 1, 2, 2], "weight": [1.0, 0.25, 0.75, 1.0]}))
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({"geo": [10, 10, 20, 30, 30, 99],
+                         "time": pd.to_datetime(["2017-01-01", "2017-01-31", "2017-02-01",
+                                                 "2017-03-15", "2017-03-15", "2017-01-01"]),
+                         "category": ["x", "y", "x", "x", "x", "x"]})
+
+
+def test_from_events(df):
+    tensor = EventTensor.from_events(df.geo, df.time, "small", "M", df.category)
+    assert tensor.shape == (3, 3, 2)
+    assert tensor.periods.tolist() == list(pd.period_range("2017-01", "2017-03", freq="M"))
+    assert tensor.categories.tolist() == ["x", "y"]
+    dense = tensor.dense()
+    # the row with an unknown geography is dropped
+    assert dense.sum() == 5
+    assert dense[0, 0].tolist() == [1, 1]
+    assert dense[1, 1].tolist() == [1, 0]
+    assert dense[2, 2].tolist() == [2, 0]
+    frame = tensor.to_frame()
+    assert len(frame) == 4
+    assert frame["count"].sum() == 5
+
+
+def test_to_freq_matches_direct_binning(df):
+    daily = EventTensor.from_events(df.geo, df.time, "small", "D", df.category)
+    quarterly = daily.to_freq("Q")
+    direct = EventTensor.from_events(df.geo, df.time, "small", "Q", df.category)
+    assert quarterly.periods.equals(direct.periods)
+    np.testing.assert_array_equal(quarterly.dense(), direct.dense())
+
+
+def test_to_freq_bins_weeks_by_first_day():
+    # the week of Monday 2017-01-30 straddles January and February
+    tensor = EventTensor.from_events([10], pd.to_datetime(["2017-02-02"]), "small", "W")
+    monthly = tensor.to_freq("M")
+    assert monthly.periods.tolist() == [pd.Period("2017-01", freq="M")]
+
+
+def test_to_freq_rejects_finer_periods(df):
+    tensor = EventTensor.from_events(df.geo, df.time, "small", "M")
+    with pytest.raises(ValueError):
+        tensor.to_freq("D")
+
+
+def test_total(df):
+    tensor = EventTensor.from_events(df.geo, df.time, "small", "M", df.category)
+    total = tensor.total()
+    assert total.categories.tolist() == ["count"]
+    np.testing.assert_array_equal(total.dense()[:, :, 0], tensor.dense().sum(axis=2))
+
+
+def test_to_layer(df):
+    tensor = EventTensor.from_events(df.geo, df.time, "small", "M")
+    moved = tensor.to_layer("big")
+    assert moved.ids.tolist() == [1, 2]
+    np.testing.assert_allclose(moved.dense()[:, :, 0], [[2, 0.25, 0], [0, 0.75, 2]])
+
+
+def test_align(df):
+    tensor = EventTensor.from_events(df.geo, df.time, "small", "M", df.category)
+    dates = pd.date_range("2017-01-01", "2017-02-28", freq="D")
+    exposure = pd.DataFrame({10: np.arange(len(dates), dtype=float), 20: 1.0, 30: np.nan}, index=dates)
+    exposure.loc["2017-01-01":"2017-01-10", 20] = np.nan
+    aligned = tensor.align(exposure)
+    assert list(aligned.columns) == ["ID", "period", "x", "y", "exposure", "exposure_days"]
+    # every geography and period, zeros included
+    assert len(aligned) == 9
+    row = aligned.set_index(["ID", "period"])
+    jan, feb, mar = tensor.periods
+    assert row.loc[(10, jan), "exposure"] == pytest.approx(15)
+    assert row.loc[(10, jan), "exposure_days"] == 31
+    assert row.loc[(20, jan), "exposure_days"] == 21
+    assert row.loc[(20, feb), ["x", "exposure"]].tolist() == [1, 1]
+    assert np.isnan(row.loc[(30, mar), "exposure"])
+    assert row.loc[(30, mar), ["x", "exposure_days"]].tolist() == [2, 0]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from air_brain.util.features import FeatureBuilder
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2017-01-01", periods=60, freq="D")
+    values = rng.normal(size=(60, 3))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[10:20, 1] = np.nan
+    ret = pd.DataFrame(values, index=dates, columns=pd.Index(["a", "b", "c"], name="site"))
+    # drop some dates entirely, which the builder fills back in as missing
+    return ret.drop(index=dates[[5, 30, 31]])
+
+
+def test_lags_match_shift(df):
+    builder = FeatureBuilder(df)
+    full = df.reindex(pd.date_range(df.index.min(), df.index.max(), freq="D"))
+    lags = builder.lags(7)
+    assert lags.shape == (len(full), 3, 8)
+    for lag in range(8):
+        np.testing.assert_array_equal(lags[:, :, lag], full.shift(lag).to_numpy())
+
+
+@pytest.mark.parametrize("min_coverage", [0.5, 0.75, 1.0])
+def test_rolling_mean_matches_rolling(df, min_coverage):
+    builder = FeatureBuilder(df)
+    full = df.reindex(pd.date_range(df.index.min(), df.index.max(), freq="D"))
+    windows = [1, 3, 7, 30]
+    means = builder.rolling_mean(windows, min_coverage)
+    for i, window in enumerate(windows):
+        min_periods = max(1, int(np.ceil(min_coverage * window)))
+        expected = full.rolling(window, min_periods=min_periods).mean().to_numpy()
+        np.testing.assert_allclose(means[:, :, i], expected, equal_nan=True)
+
+
+def test_rolling_mean_subset_of_columns(df):
+    builder = FeatureBuilder(df)
+    np.testing.assert_allclose(builder.rolling_mean([7], columns=["c"])[:, 0],
+                               builder.rolling_mean([7])[:, 2], equal_nan=True)
+
+
+def test_to_frame_and_blocks(df):
+    builder = FeatureBuilder(df)
+    frame = builder.to_frame(max_lag=2, windows=[3])
+    assert list(frame.columns) == ["lag_0", "lag_1", "lag_2", "mean_3"]
+    assert frame.index.names == ["date", "site"]
+    date = df.index[10]
+    assert frame.loc[(date, "a"), "lag_1"] == pytest.approx(df.loc[date - pd.Timedelta(days=1), "a"], nan_ok=True)
+    blocks = pd.concat(builder.iter_frames(block_size=2, max_lag=2, windows=[3]))
+    pd.testing.assert_frame_equal(blocks.sort_index(), frame.sort_index())
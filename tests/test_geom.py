@@ -0,0 +1,27 @@
+import os
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from air_brain.util import geom
+from air_brain.util.geom import GeomRegistry
+
+
+def test_cache_without_source_is_fresh(tmp_path, monkeypatch):
+    source = tmp_path / "squares.geojson"
+    gpd.GeoDataFrame({"name": ["a", "b"]}, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)],
+                     crs="EPSG:4326").to_file(source)
+    monkeypatch.setitem(geom.layers, "squares", {"file": source, "rename": {"name": "ID"},
+                                                 "id": "ID", "id_type": str})
+    registry = GeomRegistry("EPSG:2272", cache_dir=tmp_path / "cache")
+    assert registry.is_stale("squares")
+    registry.build("squares")
+    assert not registry.is_stale("squares")
+
+    # touching the source makes the cache stale, removing it doesn't
+    os.utime(source, (os.path.getmtime(registry.cache_file("squares")) + 10,) * 2)
+    assert registry.is_stale("squares")
+    registry.build("squares")
+    os.remove(source)
+    assert not registry.is_stale("squares")
+    assert registry.ids("squares").tolist() == ["a", "b"]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from air_brain.util.interp import BlockSupport, block_krige
+from air_brain.util.uncertainty import _cholesky
+
+from conftest import SIDE, X0, Y0
+
+
+@pytest.fixture
+def support(synthetic_layers):
+    return BlockSupport("squares", cell_size=1000)
+
+
+def test_support_points(support):
+    assert len(support.ids) == 16
+    assert support.counts.sum() == len(support.xy)
+    # every geography's pair histogram with every other sums to one
+    assert np.allclose(np.asarray(support.pair_hist.sum(axis=1)).ravel(), 1)
+
+
+@pytest.mark.parametrize("variogram_model", ["gaussian", "spherical", "exponential"])
+def test_error_covariance_is_psd_for_smooth_field(support, variogram_model):
+    rng = np.random.default_rng(0)
+    xy = np.column_stack([X0 + rng.uniform(0, SIDE, 8), Y0 + rng.uniform(0, SIDE, 8)])
+    values = 10 + 1e-3 * (xy[:, 0] - X0) + 5e-4 * (xy[:, 1] - Y0) + rng.normal(0, 0.5, len(xy))
+
+    mean, cov = block_krige(xy, values, support, variogram_model)
+    assert mean.shape == (16,)
+    scale = np.abs(np.diag(cov)).max()
+    assert np.diag(cov).min() >= -1e-9 * scale
+    assert np.linalg.eigvalsh((cov + cov.T) / 2).min() >= -1e-6 * scale
+
+
+def test_cholesky_warns_when_clipping_material_variance():
+    with pytest.warns(UserWarning, match="not positive semi-definite"):
+        factor = _cholesky(np.array([[1.0, 2.0], [2.0, 1.0]]))
+    assert np.allclose(factor @ factor.T, [[1.5, 1.5], [1.5, 1.5]])
@@ -0,0 +1,91 @@
+import http.client
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from air_brain.service import ExposureService, QueryError, _records_by_id, make_handler
+from air_brain.util.daily_store import DailyStore
+
+from conftest import X0, Y0, air_rows
+
+
+def strict_loads(data):
+    def reject(constant):
+        raise ValueError("{} is not valid JSON".format(constant))
+    return json.loads(data, parse_constant=reject)
+
+
+@pytest.fixture
+def service(synthetic_air, tmp_path):
+    air_rows().to_csv(os.path.join(synthetic_air.data_dir, synthetic_air.data_file), index=False)
+    store = DailyStore(synthetic_air, layer="squares", store_dir=tmp_path / "store")
+    store.update()
+    return ExposureService(synthetic_air, layer="squares", store=store, ej=SimpleNamespace(year=2017))
+
+
+@pytest.fixture
+def client(service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection(*server.server_address, timeout=10)
+    yield conn
+    conn.close()
+    server.shutdown()
+    server.server_close()
+
+
+def request(conn, method, path, body=None):
+    conn.request(method, path, body=None if body is None else json.dumps(body))
+    response = conn.getresponse()
+    return response.status, strict_loads(response.read())
+
+
+def test_ej_missing_values_are_null():
+    df = pd.DataFrame({"ID": [1, 2], "dpm": [0.5, np.nan], "lowincome": [np.nan, 0.25]})
+    ej = _records_by_id(df)
+    assert ej == {1: {"dpm": 0.5, "lowincome": None}, 2: {"dpm": None, "lowincome": 0.25}}
+    assert strict_loads(json.dumps(ej[2], allow_nan=False)) == {"dpm": None, "lowincome": 0.25}
+
+
+def test_geography_is_a_copy(service):
+    result = service.geography(0)
+    result["values"].append(-1)
+    result["mean"] = -1
+    assert service.geography(0) != result
+    assert service.stats()["geography_cache"]["hits"] == 1
+
+
+def test_batch(service):
+    lon, lat = service.to_crs.transform(X0 + 1000, Y0 + 1000, direction="INVERSE")
+    ret = service.batch([{"id": 5}, [1, 2], {"lon": "east", "lat": lat}, {"lon": lon, "lat": lat}, {"id": 99}])
+    assert ret[0]["id"] == 5
+    assert "error" in ret[1] and "error" in ret[2] and "error" in ret[4]
+    assert ret[3]["id"] == 0
+    assert ret[3]["nearest_site"]["site"] == "Lawrenceville"
+    with pytest.raises(QueryError):
+        service.batch({"id": 5})
+
+
+def test_handler(client):
+    # the connection is kept open across all of these, including the errors
+    status, body = request(client, "POST", "/batch", {"id": 5})
+    assert status == 400 and "list" in body["error"]
+    status, body = request(client, "POST", "/batch", [[1, 2], {"id": 3}])
+    assert status == 200
+    assert "error" in body[0] and body[1]["id"] == 3
+    status, body = request(client, "GET", "/geography?id=3&start=2017-01-26&end=2017-01-28")
+    assert status == 200
+    assert body["dates"] == ["2017-01-26", "2017-01-27", "2017-01-28"]
+    status, body = request(client, "GET", "/geography?id=3&start=2017-01-28&end=2017-01-26")
+    assert status == 400
+    status, body = request(client, "GET", "/nowhere")
+    assert status == 404
+    status, body = request(client, "GET", "/stats")
+    assert status == 200 and body["geography_cache"]["misses"] == 2
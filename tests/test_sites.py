@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from air_brain.util.sites import Intervals, SiteRegistry
+
+
+def daily(rows):
+    """
+    long daily AQI frame from (site, parameter, first date, last date) runs
+    """
+    frames = [pd.DataFrame({"date": pd.date_range(first, last, freq="D"), "site": site, "parameter": param,
+                            "index_value": 1.0})
+              for site, param, first, last in rows]
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def registry():
+    return SiteRegistry(daily([("a", "PM25", "2016-12-30", "2017-01-03"),
+                               ("a", "PM25", "2017-01-06", "2017-12-31"),
+                               ("b", "PM25", "2017-01-02", "2017-01-04"),
+                               ("b", "SO2", "2017-01-10", "2017-01-10")]))
+
+
+@pytest.mark.parametrize("first, last", [(0, 40), (3, 3), (4, 5), (5, 12), (12, 30), (-5, 2), (25, 40), (9, 8)])
+def test_covered_days_matches_brute_force(first, last):
+    intervals = Intervals([0, 5, 20], [2, 10, 30])
+    covered = set(range(0, 3)) | set(range(5, 11)) | set(range(20, 31))
+    expected = len(covered & set(range(first, last + 1)))
+    assert intervals.covered_days(first, last) == expected
+
+
+def test_contains_and_gaps():
+    intervals = Intervals([0, 5], [2, 10])
+    assert [intervals.contains(d) for d in [-1, 0, 2, 3, 5, 10, 11]] == [False, True, True, False, True, True, False]
+    gaps = intervals.gaps()
+    assert (gaps.starts.tolist(), gaps.ends.tolist()) == ([3], [4])
+
+
+def test_reporting(registry):
+    assert registry.reporting("2016-12-29") == frozenset()
+    assert registry.reporting("2017-01-02") == {"a", "b"}
+    assert registry.reporting("2017-01-05") == frozenset()
+    assert registry.reporting("2017-01-10") == {"a", "b"}
+    assert registry.reporting("2017-01-10", "PM25") == {"a"}
+    assert registry.reporting("2018-01-01") == frozenset()
+
+
+def test_reporting_matches_rows(registry):
+    df = daily([("a", "PM25", "2016-12-30", "2017-01-03"),
+                ("a", "PM25", "2017-01-06", "2017-12-31"),
+                ("b", "PM25", "2017-01-02", "2017-01-04"),
+                ("b", "SO2", "2017-01-10", "2017-01-10")])
+    for date in pd.date_range("2016-12-25", "2018-01-05", freq="D"):
+        expected = set(df.loc[df.date == date, "site"])
+        assert registry.reporting(date) == expected
+
+
+def test_coverage_by_year_ends_with_the_data(registry):
+    coverage = registry.coverage_by_year("PM25")
+    # a reports through Dec 31 2017, so there is no 2018 row
+    assert coverage.index.tolist() == [2016, 2017]
+    assert coverage.loc[2016, "a"] == pytest.approx(2 / 366)
+    assert coverage.loc[2017, "a"] == pytest.approx((365 - 2) / 365)
+    assert coverage.loc[2017, "b"] == pytest.approx(3 / 365)
+
+
+def test_site_intervals_merge_parameters(registry):
+    intervals = registry.site_intervals("b")
+    assert len(intervals) == 2
+    assert intervals.covered_days(np.iinfo(np.int64).min // 2, np.iinfo(np.int64).max // 2) == 4
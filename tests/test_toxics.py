@@ -0,0 +1,37 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+
+from air_brain.util import loc
+from air_brain.util.toxics import releases, toxic_exposure
+
+from conftest import X0, Y0
+
+
+def write_releases(path, x, y):
+    points = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=loc.CRS).to_crs("EPSG:4326")
+    pd.DataFrame({"1. YEAR": [2017, 2017, 2018],
+                  "2. TRIFD": ["A", "A", "B"],
+                  "12. LATITUDE": points.y,
+                  "13. LONGITUDE": points.x,
+                  "34. CHEMICAL": ["Lead", "Lead", "Benzene"],
+                  "47. 5.1 - FUGITIVE AIR": [1.0, 2.0, 0.0],
+                  "48. 5.2 - STACK AIR": [0.0, 1.0, 4.0]}).to_csv(path, index=False)
+
+
+def test_releases(synthetic_layers):
+    path = synthetic_layers / "tri.csv"
+    write_releases(path, [X0 + 1000] * 2 + [X0 + 17000], [Y0 + 1000] * 2 + [Y0 + 17000])
+    rel = releases(path)
+    assert rel[["facility", "year", "chemical", "air"]].values.tolist() == [["A", 2017, "Lead", 4.0],
+                                                                              ["B", 2018, "Benzene", 4.0]]
+
+    exposure = toxic_exposure("squares", path, cutoff=3000, decay="none")
+    assert exposure.values.tolist() == [[0, 2017, "Lead", 4.0], [15, 2018, "Benzene", 4.0]]
+
+
+def test_missing_column(tmp_path):
+    path = tmp_path / "tri.csv"
+    pd.DataFrame({"YEAR": [2017], "FACILITY": ["A"]}).to_csv(path, index=False)
+    with pytest.raises(AssertionError, match="which has columns year, facility"):
+        releases(path)